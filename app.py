@@ -1,34 +1,102 @@
+import logging
 import gradio as gr
-import os
-import json
 from automation import GoogleEarthAutomation
+from browser_pool import BrowserPool
+from jobs import JobQueue, QueueFullError
+from model_registry import warm_up, model_stats
+from readiness import wait_stats
+from irradiance_cache import get_irradiance_cache
+from result_cache import get_result_cache
+from rooftop_index import get_rooftop_index
+from metrics import get_metrics
+from config import JOB_POLL_INTERVAL
 
-def run_automation(place_name):
-    timestamp = '20240914'
-    automation = GoogleEarthAutomation(timestamp, place_name)
-    automation.process()
-    
-    # Get paths and results
-    image_path = os.path.join(automation.paths['yolo_output'], place_name + '.png')
-    scale, location, average_irradiance, total_irradiance = automation.ocr_solar_info()
-    target_mask_info = automation.process_satellite_images()
-    
-    # Close automation
-    automation.close()
-    
-    return (image_path, scale, location, average_irradiance, total_irradiance, target_mask_info)
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+def run_automation(job):
+    result_cache = get_result_cache()
+    if not job.refresh:
+        # Another job may have produced the result while this one was queued
+        cached = result_cache.get_by_place(job.place_name)
+        if cached is not None:
+            return cached
 
-def gradio_interface(place_name):
-    image, scale, location, average_irradiance, total_irradiance, target_mask_info = run_automation(place_name)    
-    solar_info = f"Scale: {scale}\nLocation: {location}\nAverage Irradiance: {average_irradiance} W/m^2\nTotal Irradiance: {total_irradiance} kWh/m^2"
+    with browser_pool.lease() as driver:
+        automation = GoogleEarthAutomation(job.timestamp, job.place_name, driver=driver, progress=job.progress,
+                                           result_cache=None if job.refresh else result_cache,
+                                           rooftop_index=get_rooftop_index(), index_answers=not job.refresh)
+        result = automation.process()
     
-    # Convert mask analysis dictionary to JSON string
-    mask_analysis_info = json.loads(target_mask_info)
+        # Close automation (the browser itself goes back to the pool)
+        automation.close()
+
+    # A failed place (e.g. a search that did not move the camera) is neither cached nor indexed
+    if not result.errors and result.mask_analysis:
+        result_cache.put(result)
+
+    # Export stage histograms and component statistics for monitoring (metrics/metrics.json and metrics.prom);
+    # a failed export is logged and never fails the request
+    try:
+        get_metrics().write(extra={
+            "model": model_stats(),
+            "browser_pool": browser_pool.stats(),
+            "readiness_waits": wait_stats(),
+            "irradiance_cache": get_irradiance_cache().stats(),
+            "job_queue": job_queue.stats(),
+            "result_cache": result_cache.stats(),
+            "rooftop_index": get_rooftop_index().stats(),
+        })
+    except Exception:
+        logger.exception("Could not export metrics")
     
-    return image, solar_info, mask_analysis_info
+    return result
+
+def format_solar_info(result):
+    return f"Scale: {result.scale}\nLocation: {result.location}\nAverage Irradiance: {result.average_irradiance} W/m^2\nTotal Irradiance: {result.total_irradiance} kWh/m^2"
+
+def gradio_interface(place_name, refresh=False):
+    # Places analysed before are answered from the result cache without starting a job
+    if not refresh:
+        cached = get_result_cache().get_by_place(place_name)
+        if cached is not None:
+            yield cached.image, format_solar_info(cached), cached.mask_analysis
+            return
+
+    try:
+        job = job_queue.submit(place_name, refresh)
+    except QueueFullError:
+        yield None, "The service is busy, please try again in a few minutes.", None
+        return
+
+    # Poll the job and report its progress until it finishes
+    while not job.wait(JOB_POLL_INTERVAL):
+        if job.status == 'queued':
+            yield None, f"Queued, {job_queue.position(job)} request(s) ahead.", None
+        else:
+            yield None, f"Running, finished: {', '.join(job.stages_done) or 'starting'}.", None
+
+    if job.status == 'failed':
+        yield None, f"Error: {job.error}", None
+        return
+
+    result = job.result
+    yield result.image, format_solar_info(result), result.mask_analysis
+
+# Load and warm up the rooftop model once, before the first request arrives
+warm_up()
+
+# Start the warm browser sessions requests are served from
+browser_pool = BrowserPool().start()
+
+# One worker per browser; requests beyond that wait in the bounded queue
+job_queue = JobQueue(run_automation)
 
 # Gradio Interface
-inputs = gr.Textbox(label="Enter Location", placeholder="Enter the house name, City name.")
+inputs = [
+    gr.Textbox(label="Enter Location", placeholder="Enter the house name, City name."),
+    gr.Checkbox(label="Refresh (ignore cached result)", value=False)
+]
 outputs = [
     gr.Image(label="Rooftop Image, location the black dot for your rooftop."),
     gr.Textbox(label="Solar Information"),
@@ -40,4 +108,4 @@ gr.Interface(
     inputs=inputs,
     outputs=outputs,
     title="Rooftop Solar Potential, POWERED BY AI"
-).launch(share=True)
+).queue(default_concurrency_limit=None).launch(share=True)
@@ -0,0 +1,254 @@
+import argparse
+import json
+import logging
+import math
+import time
+from collections import deque
+from urllib.parse import urlsplit
+import cv2
+import numpy as np
+from shapely.geometry import Polygon, mapping
+from shapely.ops import transform
+from automation import create_configured_driver, crop_satellite_view
+from config import (SCAN_METRES_PER_PIXEL, SCAN_TILE_OVERLAP, SCAN_MERGE_IOU, SCAN_MERGE_CONTAINMENT,
+                    SCAN_VIEWPORT_SIZE, SCAN_FIELD_OF_VIEW, BATCH_SIZE)
+from geo import CROP_WIDTH, CROP_HEIGHT, CROP_CENTER_X, CROP_CENTER_Y, LocalFrame, camera_distance
+from model import InferenceBatcher
+from model_registry import warm_up
+from readiness import wait_for_stable_view
+
+logger = logging.getLogger(__name__)
+
+
+def camera_url(latitude, longitude, metres_per_pixel=SCAN_METRES_PER_PIXEL):
+    """A Google Earth URL looking straight down at the point."""
+    return (f"https://earth.google.com/web/@{latitude:.7f},{longitude:.7f},0a,"
+            f"{camera_distance(metres_per_pixel):.1f}d,{SCAN_FIELD_OF_VIEW}y,0h,0t,0r")
+
+
+def plan_tiles(min_lat, min_lon, max_lat, max_lon, overlap=SCAN_TILE_OVERLAP, metres_per_pixel=SCAN_METRES_PER_PIXEL):
+    """
+    Plan a grid of camera positions whose satellite crops cover the bounding box with `overlap`
+    (a fraction of the tile size) between neighbours, so every roof cut by one tile's edge is whole in another.
+
+    Returns:
+        tuple: The LocalFrame of the box and a list of tiles as dicts with row, col, latitude and longitude.
+    """
+    frame = LocalFrame(min_lat, min_lon)
+    width, height = frame.to_metres(max_lat, max_lon)
+    tile_width = CROP_WIDTH * metres_per_pixel
+    tile_height = CROP_HEIGHT * metres_per_pixel
+    step_x = tile_width * (1 - overlap)
+    step_y = tile_height * (1 - overlap)
+
+    columns = max(1, math.ceil(max(width - tile_width, 0) / step_x) + 1)
+    rows = max(1, math.ceil(max(height - tile_height, 0) / step_y) + 1)
+
+    # The camera looks at the viewport centre, which is below the crop centre
+    offset_y = (SCAN_VIEWPORT_SIZE[1] / 2 - CROP_CENTER_Y) * metres_per_pixel
+
+    tiles = []
+    for row in range(rows):
+        for col in range(columns):
+            x = tile_width / 2 + col * step_x
+            y = tile_height / 2 + row * step_y
+            latitude, longitude = frame.to_degrees(x, y - offset_y)
+            tiles.append({"row": row, "col": col, "latitude": latitude, "longitude": longitude, "x": x, "y": y})
+    return frame, tiles
+
+
+def crop_polygons_to_metres(polygons_xy, tile, metres_per_pixel=SCAN_METRES_PER_PIXEL):
+    """Convert mask outlines in crop pixels to polygons in the scan's metre frame."""
+    polygons = []
+    for points in polygons_xy:
+        if len(points) < 3:
+            continue
+        xs = tile["x"] + (np.asarray(points)[:, 0] - CROP_WIDTH / 2) * metres_per_pixel
+        ys = tile["y"] - (np.asarray(points)[:, 1] - CROP_HEIGHT / 2) * metres_per_pixel
+        polygon = Polygon(zip(xs, ys))
+        if not polygon.is_valid:
+            polygon = polygon.buffer(0)
+        if not polygon.is_empty:
+            polygons.append(polygon)
+    return polygons
+
+
+class RooftopMerger:
+    """
+    Merges rooftop polygons from overlapping tiles into single rooftops.
+
+    Polygons are kept in a uniform grid index, so each new polygon is only compared with rooftops in
+    the cells its bounding box touches and the merge stays near-linear in the number of tiles. Two
+    polygons are the same rooftop if their IoU is at least `iou`, or if one lies mostly inside the
+    other (`containment` of the smaller one's area), as happens when a tile edge cuts a roof.
+    """
+
+    def __init__(self, cell_size, iou=SCAN_MERGE_IOU, containment=SCAN_MERGE_CONTAINMENT):
+        self.cell_size = cell_size
+        self.iou = iou
+        self.containment = containment
+        self.rooftops = {}
+        self.sources = {}
+        self._cells = {}
+        self._next_id = 0
+
+    def _cells_for(self, polygon):
+        min_x, min_y, max_x, max_y = polygon.bounds
+        for cx in range(int(math.floor(min_x / self.cell_size)), int(math.floor(max_x / self.cell_size)) + 1):
+            for cy in range(int(math.floor(min_y / self.cell_size)), int(math.floor(max_y / self.cell_size)) + 1):
+                yield cx, cy
+
+    def _index(self, rooftop_id, polygon):
+        for cell in self._cells_for(polygon):
+            self._cells.setdefault(cell, set()).add(rooftop_id)
+
+    def _unindex(self, rooftop_id, polygon):
+        for cell in self._cells_for(polygon):
+            self._cells.get(cell, set()).discard(rooftop_id)
+
+    def _matches(self, polygon, other):
+        intersection = polygon.intersection(other).area
+        if intersection == 0:
+            return False
+        union = polygon.area + other.area - intersection
+        return intersection / union >= self.iou or intersection / min(polygon.area, other.area) >= self.containment
+
+    def add(self, polygon, source):
+        candidates = set()
+        for cell in self._cells_for(polygon):
+            candidates |= self._cells.get(cell, set())
+
+        matched = [rooftop_id for rooftop_id in candidates if self._matches(polygon, self.rooftops[rooftop_id])]
+        merged = polygon
+        sources = {source}
+        for rooftop_id in matched:
+            merged = merged.union(self.rooftops[rooftop_id])
+            sources |= self.sources.pop(rooftop_id)
+            self._unindex(rooftop_id, self.rooftops.pop(rooftop_id))
+
+        if merged.geom_type != 'Polygon':
+            # Pieces that only touch after the union: keep the outline around them
+            merged = merged.convex_hull
+
+        rooftop_id = self._next_id
+        self._next_id += 1
+        self.rooftops[rooftop_id] = merged
+        self.sources[rooftop_id] = sources
+        self._index(rooftop_id, merged)
+        return rooftop_id
+
+
+# Route the already loaded Earth app to a new camera URL the way its back/forward navigation does,
+# which moves the camera without reloading the page and re-rendering the globe. The history entry is
+# replaced rather than pushed, so a long scan does not grow the session history
+NAVIGATE_SCRIPT = """
+window.history.replaceState(null, '', arguments[0]);
+window.dispatchEvent(new PopStateEvent('popstate', {state: null}));
+"""
+
+
+def move_camera(driver, url):
+    """
+    Move the camera of the loaded page to `url` and wait for the view to settle. Falls back to loading
+    the URL, a full page reload, if the view does not change.
+    """
+    driver.execute_script(NAVIGATE_SCRIPT, urlsplit(url)._replace(scheme='', netloc='').geturl())
+    if not wait_for_stable_view(driver, 'tile', require_change=True):
+        logger.warning("Camera did not move within the page, reloading it at the tile")
+        driver.get(url)
+        wait_for_stable_view(driver, 'tile', require_change=True)
+
+
+def capture_tile(driver, tile, metres_per_pixel=SCAN_METRES_PER_PIXEL):
+    """Fly the camera to a tile and return its satellite crop."""
+    move_camera(driver, camera_url(tile["latitude"], tile["longitude"], metres_per_pixel))
+    png = driver.get_screenshot_as_png()
+    image = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+    crop_image, _ = crop_satellite_view(image, CROP_WIDTH, CROP_HEIGHT, CROP_CENTER_X, CROP_CENTER_Y)
+    return crop_image
+
+
+def scan_area(driver, min_lat, min_lon, max_lat, max_lon, overlap=SCAN_TILE_OVERLAP,
+              metres_per_pixel=SCAN_METRES_PER_PIXEL, batcher=None, capture=capture_tile):
+    """
+    Capture and segment every tile of the bounding box and merge the rooftops across tiles.
+
+    Tiles are captured one after another while earlier tiles are still being segmented, and each
+    tile's masks are merged as soon as its segmentation finishes, so memory holds only a few tiles.
+
+    Returns:
+        list[dict]: One rooftop per merged polygon, with its outline in (latitude, longitude),
+        area in square metres and the tiles it was seen in.
+    """
+    frame, tiles = plan_tiles(min_lat, min_lon, max_lat, max_lon, overlap, metres_per_pixel)
+    logger.info(f"Scanning {len(tiles)} tiles")
+    batcher = batcher or InferenceBatcher(batch_size=BATCH_SIZE, render=False)
+    merger = RooftopMerger(cell_size=CROP_WIDTH * metres_per_pixel / 2)
+    pending = deque()
+
+    def merge(tile, future):
+        masks = future.result()["masks"]
+        if masks is None:
+            return
+        for polygon in crop_polygons_to_metres(masks.polygons, tile, metres_per_pixel):
+            merger.add(polygon, (tile["row"], tile["col"]))
+
+    start_time = time.perf_counter()
+    for index, tile in enumerate(tiles):
+        crop = capture(driver, tile, metres_per_pixel)
+        # The crop is a view into the screenshot; copy it so the batcher owns its pixels
+        pending.append((tile, batcher.submit(np.ascontiguousarray(crop))))
+        while pending and pending[0][1].done():
+            merge(*pending.popleft())
+        logger.info(f"Tile {index + 1}/{len(tiles)}, {len(merger.rooftops)} rooftops so far")
+    while pending:
+        merge(*pending.popleft())
+    logger.info(f"Scanned {len(tiles)} tiles in {time.perf_counter() - start_time:.1f} seconds, {len(merger.rooftops)} rooftops")
+
+    rooftops = []
+    for rooftop_id, polygon in merger.rooftops.items():
+        outline = transform(lambda x, y: frame.to_degrees(x, y), polygon)
+        rooftops.append({
+            "id": rooftop_id,
+            "polygon": [list(point) for point in outline.exterior.coords],
+            "area": round(polygon.area, 2),
+            "tiles": sorted(merger.sources[rooftop_id]),
+        })
+    return rooftops
+
+
+def to_geojson(rooftops):
+    """GeoJSON FeatureCollection of the rooftops (GeoJSON orders coordinates longitude, latitude)."""
+    features = []
+    for rooftop in rooftops:
+        polygon = Polygon([(longitude, latitude) for latitude, longitude in rooftop["polygon"]])
+        features.append({
+            "type": "Feature",
+            "geometry": mapping(polygon),
+            "properties": {"id": rooftop["id"], "area": rooftop["area"], "tiles": rooftop["tiles"]},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Map every rooftop in a bounding box")
+    parser.add_argument('--bbox', type=float, nargs=4, required=True, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+    parser.add_argument('--overlap', type=float, default=SCAN_TILE_OVERLAP)
+    parser.add_argument('--output', default='rooftops.geojson')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    warm_up()
+    driver = create_configured_driver()
+    try:
+        rooftops = scan_area(driver, *args.bbox, overlap=args.overlap)
+    finally:
+        driver.quit()
+
+    with open(args.output, 'w') as f:
+        json.dump(to_geojson(rooftops), f)
+    print(f"Wrote {len(rooftops)} rooftops to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
+import logging
 import os
 import cv2
+import numpy as np
 import time
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
@@ -8,30 +10,317 @@ from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.firefox.service import Service as FirefoxService
 from webdriver_manager.firefox import GeckoDriverManager
-from config import get_paths
-from model import process_image, analyze_masks
-from solar_api import solar_info
+from config import (get_paths, READINESS_TIMEOUTS, IN_MEMORY_PIPELINE, ARCHIVE_ARTIFACTS, SCREENSHOT_WORKERS,
+                    ROOFTOP_INDEX_MAX_TILT, SCAN_FIELD_OF_VIEW)
+from geo import ground_resolution, crop_to_degrees
+from mask_encoding import CompactMasks
+from metrics import timed, observe
+from model import process_image, process_images_batch, analyze_masks
+from solar_api import process_image_with_ocr, get_lat_long_from_location, fetch_solar_irradiance, format_location
+from pipeline import StageGraph, PipelineResult
+from readiness import wait_for_document_ready, wait_for_stable_view, wait_for_focused_input, focused_input
+from replay import ReplayError
 import json
+import re
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=None)
+def gecko_driver_path():
+    """Resolve geckodriver once per process instead of once per browser."""
+    return GeckoDriverManager().install()
+
+@timed('browser_startup')
+def create_driver():
+    """Launch headless Firefox, open Google Earth and size the window for the screenshot crops."""
+    options = FirefoxOptions()
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--headless')
+
+    # Set up WebDriver
+    driver = webdriver.Firefox(service=FirefoxService(gecko_driver_path()), options=options)
+
+    # Open Google Earth and set window size after it loads
+    driver.get("https://earth.google.com/")
+    wait_for_document_ready(driver, 'page_load')
+    driver.set_window_size(1280, 720)
+    wait_for_stable_view(driver, 'globe_render', require_change=True)
+    logger.debug(f"Current window size: {driver.get_window_size()}")
+    return driver
+
+def send_keys_with_action_chains(driver, key1, key2):
+    action = ActionChains(driver)
+    action.key_down(key1).key_down(key2).key_up(key2).key_up(key1).perform()
+
+def find_search_box(driver):
+    """
+    The search input, focused. If it does not have the focus yet, the '/' shortcut opens it first.
+    Raises RuntimeError if it does not appear in time.
+    """
+    element = focused_input(driver)
+    if element is None:
+        driver.find_element(By.TAG_NAME, "body").send_keys('/')
+        element = wait_for_focused_input(driver, 'search_box')
+    if element is None:
+        raise RuntimeError(f"Search box not found within {READINESS_TIMEOUTS['search_box']} seconds")
+    return element
+
+@timed('layer_setup')
+def configure_layers(driver):
+    """Switch to the clean layer style and focus the search box. Returns True on success."""
+    try:
+        driver.find_element(By.XPATH, "//*").send_keys(Keys.ESCAPE)
+        wait_for_stable_view(driver, 'panel')
+        send_keys_with_action_chains(driver, Keys.CONTROL, 'b')
+        wait_for_stable_view(driver, 'panel', require_change=True)
+        ActionChains(driver).move_by_offset(245, 277).click().perform()
+        wait_for_stable_view(driver, 'layer_style')
+        send_keys_with_action_chains(driver, Keys.CONTROL, 'b')
+        wait_for_stable_view(driver, 'panel', require_change=True)
+        find_search_box(driver)
+        wait_for_stable_view(driver, 'panel')
+        return True
+    except Exception as e:
+        logger.error(f"Error configuring layers: {e}")
+        return False
+
+def reset_search(driver):
+    """Return a leased browser to the state configure_layers leaves it in: no open panel, search box focused."""
+    body = driver.find_element(By.TAG_NAME, "body")
+    body.send_keys(Keys.ESCAPE)
+    wait_for_stable_view(driver, 'panel')
+    body.send_keys('/')
+    wait_for_stable_view(driver, 'panel')
+
+def create_configured_driver():
+    """
+    Start a browser that is ready to search: Google Earth loaded and layers configured. A browser whose
+    layers could not be configured is quit and RuntimeError raised, so the pool retries as for a failed start.
+    """
+    driver = create_driver()
+    if not configure_layers(driver):
+        driver.quit()
+        raise RuntimeError("Could not configure the Google Earth layers")
+    return driver
+
+# Camera position in Google Earth URLs: .../@<latitude>,<longitude>,<altitude>a,<distance>d,...
+CAMERA_URL_PATTERN = re.compile(r'@(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),')
+
+def coordinates_from_url(url):
+    """Latitude and longitude of the camera target in a Google Earth URL, rounded like the OCR path, or None."""
+    if not url:
+        return None
+    match = CAMERA_URL_PATTERN.search(url)
+    if match is None:
+        return None
+    latitude, longitude = float(match.group(1)), float(match.group(2))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return round(latitude, 4), round(longitude, 4)
+
+# Camera parameters after the position, each a number with a one-letter unit suffix
+CAMERA_URL_FIELDS = {'a': 'altitude', 'd': 'distance', 'y': 'field_of_view', 'h': 'heading', 't': 'tilt', 'r': 'roll'}
+
+def camera_view_from_url(url):
+    """
+    The full camera of a Google Earth URL as a dict: unrounded latitude and longitude plus whichever of
+    altitude, distance, field_of_view, heading, tilt and roll it gives. None if there is no camera position.
+    """
+    coordinates = coordinates_from_url(url)
+    if coordinates is None:
+        return None
+    fields = url.split('@', 1)[1].split('/')[0].split(',')
+    view = {"latitude": float(fields[0]), "longitude": float(fields[1])}
+    for field in fields[2:]:
+        match = re.fullmatch(r'(-?\d+(?:\.\d+)?)([a-z])', field)
+        if match and match.group(2) in CAMERA_URL_FIELDS:
+            view[CAMERA_URL_FIELDS[match.group(2)]] = float(match.group(1))
+    return view
+
+MANIFEST_NAME = '.manifest.sqlite'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": digest}
+
+def is_processed(entry, path):
+    """Whether a manifest entry still matches the file: a matching mtime and size, or failing that, a matching hash."""
+    if entry is None or not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    if stat.st_mtime_ns == entry["mtime_ns"] and stat.st_size == entry["size"]:
+        return True
+    return file_fingerprint(path)["sha1"] == entry["sha1"]
+
+class ScreenshotManifest:
+    """
+    The processed screenshots of a folder, one SQLite row per screenshot, so entries are looked up
+    and written one at a time whatever the number of screenshots already in the folder.
+    """
+
+    def __init__(self, folder):
+        self._connection = sqlite3.connect(os.path.join(folder, MANIFEST_NAME))
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS screenshots ("
+            " name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, sha1 TEXT, output TEXT, cropped TEXT)")
+
+    def get(self, name):
+        row = self._connection.execute(
+            "SELECT mtime_ns, size, sha1, output, cropped FROM screenshots WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("mtime_ns", "size", "sha1", "output", "cropped"), row))
+
+    def put(self, name, entry):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO screenshots VALUES (?, ?, ?, ?, ?, ?)",
+            (name, entry["mtime_ns"], entry["size"], entry["sha1"], entry["output"], entry["cropped"]))
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+def crop_satellite_view(image, rect_width=540, rect_height=470, x_center=640, y_center=315):
+    """
+    Locate the satellite view around the screen centre.
+
+    Returns:
+        tuple: The crop as a view into `image` (no copy) and the rectangle as ((x1, y1), (x2, y2)).
+    """
+    x = x_center - (rect_width // 2)
+    y = y_center - (rect_height // 2)
+    rect_bottom_right_x = x + rect_width
+    rect_bottom_right_y = y + rect_height
+    crop_image = image[y:rect_bottom_right_y, x:rect_bottom_right_x]
+    return crop_image, ((x, y), (rect_bottom_right_x, rect_bottom_right_y))
+
+@timed('crop')
+def process_screenshot(img_name, input_folder_path, output_folder_path, cropped_folder_path):
+    """Draw the crop rectangle on one screenshot and save it and its crop. Returns True on success."""
+    img_input_path = os.path.join(input_folder_path, img_name)
+    img_output_path = os.path.join(output_folder_path, img_name)
+    img_cropped_path = os.path.join(cropped_folder_path, img_name)
+    image = cv2.imread(img_input_path)
+    if image is None:
+        logger.error(f"Error reading image: {img_name}")
+        return False
+
+    crop_image, (top_left, bottom_right) = crop_satellite_view(image)
+    cv2.rectangle(image, top_left, bottom_right, (0, 255, 0), 2)
+    cv2.imwrite(img_output_path, image)
+    cv2.imwrite(img_cropped_path, crop_image)
+    return True
+
+def process_screenshots(input_folder_path, output_folder_path, cropped_folder_path, incremental=True,
+                        max_workers=SCREENSHOT_WORKERS, names=None):
+    """
+    Annotate and crop the screenshots in a folder.
+
+    In incremental mode a manifest in the output folder records each processed screenshot's
+    fingerprint and output paths, so only new or changed screenshots are processed and
+    screenshots annotated in place are never annotated twice. Remaining work runs on a thread pool.
+
+    Parameters:
+        names (list[str] | None): Only consider these screenshots, e.g. the one just captured, instead
+            of listing the folder; their manifest entries are looked up one by one.
+    """
+    if names is None:
+        images = [img_name for img_name in os.listdir(input_folder_path)
+                  if img_name.lower().endswith(IMAGE_EXTENSIONS)]
+    else:
+        images = [img_name for img_name in names if os.path.exists(os.path.join(input_folder_path, img_name))]
+
+    manifest = ScreenshotManifest(output_folder_path) if incremental else None
+    try:
+        pending = [img_name for img_name in images
+                   if manifest is None or not is_processed(manifest.get(img_name), os.path.join(input_folder_path, img_name))]
+        if not pending:
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            processed = list(executor.map(
+                lambda img_name: process_screenshot(img_name, input_folder_path, output_folder_path, cropped_folder_path),
+                pending))
+
+        if manifest is not None:
+            for img_name, ok in zip(pending, processed):
+                if ok:
+                    manifest.put(img_name, {
+                        # Fingerprint the input after processing, as it may have been annotated in place
+                        **file_fingerprint(os.path.join(input_folder_path, img_name)),
+                        "output": os.path.join(output_folder_path, img_name),
+                        "cropped": os.path.join(cropped_folder_path, img_name),
+                    })
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+class SearchNotFoundError(Exception):
+    """Raised when a search leaves the camera where it was, so the view is not of the searched place."""
 
 class GoogleEarthAutomation:
-    def __init__(self, timestamp, place_name):
-        self.paths = get_paths(timestamp)
+    def __init__(self, timestamp, place_name, driver=None, in_memory=IN_MEMORY_PIPELINE, archive=ARCHIVE_ARTIFACTS,
+                 progress=None, result_cache=None, segmenter=None, rooftop_index=None, index_answers=True,
+                 session=None):
+        """
+        Parameters:
+            timestamp: Run identifier used for the output folders.
+            place_name (str): Place to search for.
+            driver: An already configured driver, e.g. leased from a BrowserPool. When given, the
+                browser is neither started, reconfigured nor quit by this object.
+            in_memory (bool): Keep screenshots as decoded arrays and hand crop views to segmentation
+                and OCR instead of round-tripping PNGs through the `get_paths` folders.
+            archive (bool): In in-memory mode, also write the screenshots, crops, overlay and OCR strip
+                to disk for debugging.
+            progress: Optional callback, called as progress(stage_name, ok) as each stage of `process` finishes.
+            result_cache: Optional ResultCache. Once the search has resolved the coordinates, a fresh
+                cached result for them replaces segmentation and the irradiance fetch.
+            segmenter: Optional callable used in in-memory mode in place of a direct model call. It takes
+                (crop, output_path) and returns a `process_images_batch` item, e.g. InferenceBatcher.submit
+                wrapped to wait for the result.
+            rooftop_index: Optional RooftopIndex. Freshly segmented views are recorded in it and, with
+                `index_answers`, a fresh capture covering the place replaces segmentation and the
+                irradiance fetch, as a cached result does.
+            index_answers (bool): Answer from the rooftop index. When False the index is only written to.
+            session: Optional replay.Recorder, to record the browser steps, screenshots and irradiance
+                response of this place, or replay.Replayer, to play them back (with simulated latency)
+                instead of using a browser and the network. Everything downstream runs unchanged.
+        """
+        # In memory, the run folders are only written to when archiving
+        self.paths = get_paths(timestamp, create=not in_memory or archive)
         self.place_name = place_name
-        self.options = FirefoxOptions()
-        self.options.add_argument('--no-sandbox')
-        self.options.add_argument('--disable-dev-shm-usage')
-        self.options.add_argument('--headless')
-
-        # Set up WebDriver
-        self.driver = webdriver.Firefox(service=FirefoxService(GeckoDriverManager().install()), options=self.options)
-        self.action_chains = ActionChains(self.driver)
-
-        # Open Google Earth and set window size after it loads
-        self.driver.get("https://earth.google.com/")
-        time.sleep(2)
-        self.driver.set_window_size(1280, 720)
-        time.sleep(5)
-        print(f"Current window size: {self.driver.get_window_size()}")
+        self.in_memory = in_memory
+        self.archive = archive
+        self.progress = progress
+        self.result_cache = result_cache
+        self.segmenter = segmenter
+        self.rooftop_index = rooftop_index
+        self.index_answers = index_answers
+        self.cached_result = None
+        self.screenshots = {}
+        self.crops = {}
+        self.overlay = None
+        self.masks = None
+        self.camera_url = None
+        self.result = None
+        self.coordinate_source = None
+        self.coordinate_trace = []
+        self.session = session
+        replaying = session is not None and session.mode == 'replay'
+        self.owns_driver = driver is None and not replaying
+        # A replayed place recorded on a pooled, already configured browser has no layer setup to replay
+        self.layers_configured = driver is not None or (replaying and not session.recorded('configure_layers'))
+
+        self.driver = driver if driver is not None or replaying else create_driver()
+        self.action_chains = ActionChains(self.driver) if self.driver is not None else None
         # self.driver.save_screenshot(os.path.join(self.paths['run_screenshot'], '1_load_page.png'))
 
     def resize_image(self, input_path, output_path, size):
@@ -40,118 +329,329 @@ class GoogleEarthAutomation:
         image_resized = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
         cv2.imwrite(output_path, image_resized)
 
-    def measure_time(self, func, *args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        print(f"Time taken for {func.__name__}: {end_time - start_time:.2f} seconds")
-        return result
-    
     def send_keys_with_action_chains(self, driver, key1, key2):
-        action = ActionChains(driver)
-        action.key_down(key1).key_down(key2).key_up(key2).key_up(key1).perform()
+        send_keys_with_action_chains(driver, key1, key2)
+
+    def call(self, name, func):
+        """Run one browser or network step, through the record/replay session if there is one."""
+        return func() if self.session is None else self.session.call(name, func)
 
     def configure_layers(self):
-        try:
-            self.driver.find_element(By.XPATH, "//*").send_keys(Keys.ESCAPE)
-            time.sleep(2)
-            # self.driver.save_screenshot(os.path.join(self.paths['run_screenshot'], '2_click_esc.png'))
-            self.send_keys_with_action_chains(self.driver, Keys.CONTROL, 'b')
-            time.sleep(2)
-            # self.driver.save_screenshot(os.path.join(self.paths['run_screenshot'], '3_click_layers.png'))
-            self.action_chains.move_by_offset(245, 277).click().perform()
-            time.sleep(2)
-            # self.driver.save_screenshot(os.path.join(self.paths['run_screenshot'], '4_click_layers_clean.png'))
-            self.send_keys_with_action_chains(self.driver, Keys.CONTROL, 'b')
-            time.sleep(2)
-            self.driver.find_element(By.TAG_NAME, "body").send_keys('/')
-            time.sleep(2)
-            # self.driver.save_screenshot(os.path.join(self.paths['run_screenshot'], '5_click_search.png'))
-        except Exception as e:
-            print(f"Error configuring layers: {e}")
+        self.layers_configured = self.call('configure_layers', lambda: configure_layers(self.driver))
+
+    def submit_search(self):
+        """
+        Search for the place.
+
+        Returns:
+            dict: `moved`, whether the camera URL changed (it does not when nothing was found and a pooled
+            browser still shows the previous request's place), and `settled`, whether the view settled in time.
+        """
+        previous_url = self.driver.current_url
+        search_field = find_search_box(self.driver)
+        search_field.send_keys(Keys.CONTROL + 'a')
+        search_field.send_keys(Keys.BACKSPACE)
+        search_field.send_keys(self.place_name)
+        search_field.send_keys(Keys.ENTER)
+
+        # Wait for the fly-to animation to start, finish and for the imagery tiles to stop sharpening
+        settled = wait_for_stable_view(self.driver, 'search_results', require_change=True)
+        if not settled:
+            logger.warning(f"View did not settle within {READINESS_TIMEOUTS['search_results']} seconds, capturing anyway")
+        return {"moved": self.driver.current_url != previous_url, "settled": settled}
+
+    def hide_marker(self):
+        self.driver.find_element(By.TAG_NAME, "body").send_keys(Keys.ESCAPE)
+        wait_for_stable_view(self.driver, 'marker_hidden', require_change=True)
 
+    @timed('search')
     def search_place(self):
         try:
-            search_field = self.driver.find_element(By.TAG_NAME, "body")
-            time.sleep(1)
-            search_field.send_keys(Keys.CONTROL + 'a')
-            time.sleep(1)
-            search_field.send_keys(Keys.BACKSPACE)
-            time.sleep(1)
-            search_field.send_keys(self.place_name)
-            time.sleep(2)
-            search_field.send_keys(Keys.ENTER)
-            time.sleep(20)
-            screenshot_path_marker = os.path.join(self.paths['place_screenshot_marker'], self.place_name + '.png')
-            self.driver.save_screenshot(screenshot_path_marker)
-            time.sleep(1)
-            self.driver.find_element(By.TAG_NAME, "body").send_keys(Keys.ESCAPE)
-            time.sleep(2)
-            screenshot_path = os.path.join(self.paths['place_screenshot'], self.place_name + '.png')
-            self.driver.save_screenshot(screenshot_path)
+            search = self.call('search', self.submit_search)
+            if not search["moved"]:
+                # The view still shows the previous place: analysing it would answer for the wrong place
+                raise SearchNotFoundError(f"Search for {self.place_name} did not move the camera")
+            camera_url = self.call('camera_url', lambda: self.driver.current_url)
+            # A view that did not settle may not be at its final position yet: resolve by OCR, and neither
+            # answer from nor write to the caches keyed by camera position
+            self.camera_url = camera_url if search["settled"] else None
+            self.capture_screenshot('place_screenshot_marker')
+            self.call('hide_marker', self.hide_marker)
+            self.capture_screenshot('place_screenshot')
+        except (ReplayError, SearchNotFoundError):
+            # A recording that does not match the run, or a place that was not found, must fail the
+            # place, not degrade it quietly
+            raise
         except Exception as e:
             print(f"Error searching place: {e}")
 
-    def process_screenshots(self, input_folder_path, output_folder_path, cropped_folder_path):
-        images = os.listdir(input_folder_path)
-        for img_name in images:
-            img_input_path = os.path.join(input_folder_path, img_name)
-            img_output_path = os.path.join(output_folder_path, img_name)
-            img_cropped_path = os.path.join(cropped_folder_path, img_name)
-            image = cv2.imread(img_input_path)
-            if image is not None:
-                h, w = image.shape[:2]
-                rect_width = 540
-                rect_height = 470
-                x_center = 640
-                y_center = 315
-                x = x_center - (rect_width // 2)
-                y = y_center - (rect_height // 2)
-                rect_bottom_right_x = x + rect_width
-                rect_bottom_right_y = y + rect_height
-                cv2.rectangle(image, (x, y), (rect_bottom_right_x, rect_bottom_right_y), (0, 255, 0), 2)
-                cv2.imwrite(img_output_path, image)
-                crop_image = image[y:rect_bottom_right_y, x:rect_bottom_right_x]
-                cv2.imwrite(img_cropped_path, crop_image)
-            else:
-                print(f"Error reading image: {img_name}")
+    @timed('screenshot')
+    def capture_screenshot(self, folder_key):
+        """Save a screenshot to the folder `folder_key`, or in in-memory mode decode it once and keep the array."""
+        screenshot_path = os.path.join(self.paths[folder_key], self.place_name + '.png')
+        if not self.in_memory and self.session is None:
+            self.driver.save_screenshot(screenshot_path)
+            return
 
+        png = self.call('screenshot:' + folder_key, lambda: self.driver.get_screenshot_as_png())
+        if not self.in_memory:
+            with open(screenshot_path, 'wb') as f:
+                f.write(png)
+            return
 
-    def process_satellite_images(self):
+        self.screenshots[folder_key] = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+        if self.archive:
+            with open(screenshot_path, 'wb') as f:
+                f.write(png)
+
+    @timed('crop')
+    def process_screenshots_in_memory(self):
+        """Crop the in-memory screenshots into views for segmentation, archiving annotated copies if requested."""
+        cropped_folders = {'place_screenshot_marker': 'satellite_images_marker', 'place_screenshot': 'satellite_images'}
+        for folder_key, image in self.screenshots.items():
+            crop_image, (top_left, bottom_right) = crop_satellite_view(image)
+            self.crops[folder_key] = crop_image
+            if self.archive:
+                annotated = image.copy()
+                cv2.rectangle(annotated, top_left, bottom_right, (0, 255, 0), 2)
+                cv2.imwrite(os.path.join(self.paths[folder_key], self.place_name + '.png'), annotated)
+                cv2.imwrite(os.path.join(self.paths[cropped_folders[folder_key]], self.place_name + '.png'), crop_image)
+
+    def process_screenshot(self, img_name, input_folder_path, output_folder_path, cropped_folder_path):
+        return process_screenshot(img_name, input_folder_path, output_folder_path, cropped_folder_path)
+
+    def process_screenshots(self, input_folder_path, output_folder_path, cropped_folder_path, incremental=True,
+                            max_workers=SCREENSHOT_WORKERS, names=None):
+        process_screenshots(input_folder_path, output_folder_path, cropped_folder_path, incremental, max_workers, names)
+
+    def analyze_rooftops(self):
+        """Segment the satellite crop and analyse its masks. Returns the mask analysis dictionary, empty on failure."""
         img_input_path = os.path.join(self.paths['satellite_images'], self.place_name + '.png')
         img_output_path = os.path.join(self.paths['yolo_output'], self.place_name + '.png')
         
         try:
-            results = process_image(img_input_path, img_output_path)
             total_area = 36000
-            mask_analysis = analyze_masks(results, total_area)
-            print(f"Target Mask: {mask_analysis}")
+            if self.in_memory:
+                output_path = img_output_path if self.archive else None
+                if self.segmenter is not None:
+                    processed = self.segmenter(self.crops['place_screenshot'], output_path)
+                else:
+                    processed = next(process_images_batch([self.crops['place_screenshot']], [output_path], total_area=total_area))
+                # The overlay is the answer's image even when the view has no rooftops, as on the file path
+                self.overlay = processed["overlay"]
+                self.masks = processed["masks"]
+                if not processed["mask_analysis"]:
+                    raise ValueError("No masks found in the results.")
+                mask_analysis = processed["mask_analysis"]
+            else:
+                results = process_image(img_input_path, img_output_path)
+                self.masks = CompactMasks.from_result(results[0])
+                mask_analysis = analyze_masks(self.masks if self.masks is not None else results, total_area)
+            logger.debug("Target mask", extra={"mask_analysis": mask_analysis})
         except Exception as e:
             mask_analysis = {}
             print(f"Error processing image {self.place_name + '.png'}: {e}")
         
-        return json.dumps(mask_analysis)
+        return mask_analysis
+
+    def process_satellite_images(self):
+        return json.dumps(self.analyze_rooftops())
 
     
+    def resolve_coordinates(self):
+        """
+        Resolve the coordinates of the view centre, from the camera position in the browser URL and
+        only if that fails, by OCR of the coordinates strip in the screenshot.
+
+        The source used is kept in `coordinate_source` and every attempt, with its duration, in
+        `coordinate_trace`.
+
+        Returns:
+            tuple: (latitude, longitude, scale, location); "NA" for values that could not be resolved.
+        """
+        self.coordinate_trace = []
+
+        start_time = time.perf_counter()
+        coordinates = coordinates_from_url(self.camera_url)
+        self.coordinate_trace.append({"source": "url", "seconds": time.perf_counter() - start_time,
+                                      "ok": coordinates is not None})
+        observe('geocode', self.coordinate_trace[-1]["seconds"], source='url')
+        if coordinates is not None:
+            self.coordinate_source = "url"
+            latitude, longitude = coordinates
+            return latitude, longitude, "NA", format_location(latitude, longitude)
+
+        start_time = time.perf_counter()
+        if self.in_memory:
+            image = self.screenshots['place_screenshot']
+            ocr_output_path = os.path.join(self.paths['run_screenshot'], self.place_name + '_ocr.png') if self.archive else None
+        else:
+            image = os.path.join(self.paths['place_screenshot'], self.place_name + '.png')
+            ocr_output_path = "ocr_cropped.png"
+        scale, location = process_image_with_ocr(image, 788, 605, 2000, 200, ocr_output_path)
+        latitude, longitude = get_lat_long_from_location(location)
+        self.coordinate_trace.append({"source": "ocr", "seconds": time.perf_counter() - start_time,
+                                      "ok": latitude != "NA"})
+        observe('geocode', self.coordinate_trace[-1]["seconds"], source='ocr')
+        self.coordinate_source = "ocr" if latitude != "NA" else None
+        return latitude, longitude, scale, location
+
+    def fetch_irradiance(self, latitude, longitude):
+        """Average daily and total yearly irradiance at the coordinates; "NA" if unavailable."""
+        if latitude == "NA" or longitude == "NA":
+            logger.warning("Invalid location for irradiance data.")
+            return "NA", "NA"
+        try:
+            return fetch_solar_irradiance(latitude, longitude, session=self.session)
+        except ReplayError:
+            raise
+        except Exception as e:
+            logger.error(f"Error fetching irradiance for {latitude}, {longitude}: {e}")
+            return "NA", "NA"
+
     def ocr_solar_info(self):
-        img_input_path = os.path.join(self.paths['place_screenshot'], self.place_name + '.png')
-        scale, location, average_irradiance, total_irradiance = solar_info(img_input_path)
+        latitude, longitude, scale, location = self.resolve_coordinates()
+        logger.debug("Coordinates", extra={"coordinates": {
+            "latitude": latitude, "longitude": longitude, "source": self.coordinate_source, "trace": self.coordinate_trace}})
+        average_irradiance, total_irradiance = self.fetch_irradiance(latitude, longitude)
         return scale, location, average_irradiance, total_irradiance
 
+    def output_image(self):
+        """The annotated rooftop image: the in-memory RGB overlay, or the path of the saved overlay."""
+        if self.in_memory or self.cached_result is not None:
+            return self.overlay
+        return os.path.join(self.paths['yolo_output'], self.place_name + '.png')
+
+    def prepare_screenshots(self):
+        if self.in_memory:
+            self.process_screenshots_in_memory()
+        else:
+            # Only this request's screenshots, not every screenshot the run folders have collected
+            names = [self.place_name + '.png']
+            self.process_screenshots(self.paths['place_screenshot_marker'], self.paths['place_screenshot_marker'],
+                                     self.paths['satellite_images_marker'], names=names)
+            self.process_screenshots(self.paths['place_screenshot'], self.paths['place_screenshot'],
+                                     self.paths['satellite_images'], names=names)
+
+    def build_stage_graph(self):
+        """
+        The request as a stage graph: the browser stages run in sequence, then segmentation runs
+        alongside coordinate resolution and the irradiance fetch.
+        """
+        graph = StageGraph(progress=self.progress)
+        graph.add('configure_layers', lambda: None if self.layers_configured else self.configure_layers())
+        graph.add('search', lambda _: self.search_place(), deps=['configure_layers'])
+        graph.add('screenshots', lambda _: self.prepare_screenshots(), deps=['search'])
+        graph.add('cache_lookup', lambda _: self.lookup_cached_result(), deps=['search'])
+        graph.add('segmentation', lambda _, cached: self.analyze_rooftops() if cached is None else self.use_cached_rooftops(cached),
+                  deps=['screenshots', 'cache_lookup'])
+        graph.add('coordinates', lambda _: self.resolve_coordinates(), deps=['screenshots'])
+        graph.add('irradiance', lambda coordinates, cached: self.fetch_irradiance(coordinates[0], coordinates[1])
+                  if cached is None or cached.average_irradiance == "NA"
+                  else (cached.average_irradiance, cached.total_irradiance), deps=['coordinates', 'cache_lookup'])
+        return graph
+
+    def lookup_cached_result(self):
+        """
+        A cached result for the coordinates in the camera URL if a result cache was given and has one,
+        else an answer from the rooftop index if one was given and a fresh capture covers the place.
+        """
+        coordinates = coordinates_from_url(self.camera_url)
+        if coordinates is None:
+            return None
+        if self.result_cache is not None:
+            self.cached_result = self.result_cache.get_by_coordinates(*coordinates)
+        if self.cached_result is None and self.rooftop_index is not None and self.index_answers:
+            self.cached_result = self.lookup_rooftop_index(*coordinates)
+        return self.cached_result
+
+    def camera_view(self):
+        """
+        The camera target and ground resolution of the captured view, from the camera URL, as
+        (latitude, longitude, metres_per_pixel); None if the view cannot be geo-referenced.
+        """
+        view = camera_view_from_url(self.camera_url)
+        if view is None or 'distance' not in view or abs(view.get('tilt', 0)) > ROOFTOP_INDEX_MAX_TILT:
+            return None
+        return view['latitude'], view['longitude'], ground_resolution(view['distance'], view.get('field_of_view', SCAN_FIELD_OF_VIEW))
+
+    def target_coordinates(self, view):
+        """Coordinates of the target point analyze_masks checks, the centre of the satellite crop."""
+        latitude, longitude, metres_per_pixel = view
+        return crop_to_degrees([(270, 235)], latitude, longitude, metres_per_pixel)[0]
+
+    def lookup_rooftop_index(self, latitude, longitude):
+        """A PipelineResult for the place from the rooftop index, or None if no fresh capture covers it."""
+        view = self.camera_view()
+        if view is None:
+            return None
+        answer = self.rooftop_index.lookup(*self.target_coordinates(view))
+        if answer is None:
+            return None
+        logger.info(f"Answering {self.place_name} from the capture of {answer['place_name']} "
+              f"({time.time() - answer['captured_at']:.0f} seconds old)")
+        return PipelineResult(self.place_name, latitude=latitude, longitude=longitude,
+                              average_irradiance=answer["average_irradiance"], total_irradiance=answer["total_irradiance"],
+                              mask_analysis=answer["mask_analysis"])
+
+    def index_rooftops(self, result):
+        """Record the freshly segmented view of `result` in the rooftop index, if it can be geo-referenced."""
+        view = self.camera_view()
+        if view is None or self.masks is None:
+            return
+        self.rooftop_index.add_capture(self.place_name, *view, self.masks, result.mask_analysis,
+                                       result.average_irradiance, result.total_irradiance)
+
+    def use_cached_rooftops(self, cached):
+        image = cv2.imread(cached.image) if isinstance(cached.image, str) else None
+        if image is not None:
+            self.overlay = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        self.masks = cached.masks
+        logger.info(f"Using cached rooftops for {cached.latitude}, {cached.longitude}")
+        return cached.mask_analysis
+
     def process(self):
-        self.measure_time(self.configure_layers)
-        self.measure_time(self.search_place)
-        self.measure_time(self.process_screenshots, self.paths['place_screenshot_marker'], self.paths['place_screenshot_marker'], self.paths['satellite_images_marker'])
-        self.measure_time(self.process_screenshots, self.paths['place_screenshot'], self.paths['place_screenshot'], self.paths['satellite_images'])
-        self.measure_time(self.process_satellite_images)
-        self.measure_time(self.ocr_solar_info)
-        
+        """
+        Run the whole request once and return its PipelineResult, including the per-stage timing trace.
+        """
+        graph = self.build_stage_graph()
+        outputs = graph.run()
+
+        latitude, longitude, scale, location = outputs.get('coordinates', ("NA", "NA", "NA", "NA"))
+        average_irradiance, total_irradiance = outputs.get('irradiance', ("NA", "NA"))
+        self.result = PipelineResult(
+            self.place_name,
+            image=self.output_image(),
+            scale=scale,
+            location=location,
+            latitude=latitude,
+            longitude=longitude,
+            average_irradiance=average_irradiance,
+            total_irradiance=total_irradiance,
+            mask_analysis=outputs.get('segmentation'),
+            masks=self.masks,
+            coordinate_source=self.coordinate_source,
+            trace=graph.trace,
+            errors=graph.errors,
+        )
+        logger.debug("Stage timings", extra={"place_name": self.place_name, "timings": graph.timings()})
+
+        if (self.rooftop_index is not None and self.cached_result is None and not self.result.errors
+                and self.result.mask_analysis):
+            self.index_rooftops(self.result)
+        return self.result
+
     def close(self):
-        self.driver.quit()
+        if self.owns_driver:
+            self.driver.quit()
+        if self.session is not None and self.session.mode == 'record':
+            self.session.save()
+        elif self.session is not None:
+            self.session.close()
 
 # timestamp = '20240914'
 # place_name = 'Sir Duncan Rice Library, Aberdeen'
 
 # automation = GoogleEarthAutomation(timestamp, place_name)
-# automation.process()
+# result = automation.process()
 # automation.close()
@@ -0,0 +1,82 @@
+import glob
+import logging
+import hashlib
+import os
+import shutil
+from ultralytics import YOLO
+from config import BACKEND_EXPORT_DIR, BACKEND_IMAGE_SIZE, BACKEND_CALIBRATION_DATA, DEFAULT_CALIBRATION_DATA
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+def weights_fingerprint(weights_path: str, extra: str = '') -> str:
+    """Short sha1 of a weights file (and of `extra`, e.g. the calibration data), so a retrained model gets a new export."""
+    digest = hashlib.sha1(extra.encode())
+    with open(weights_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def export_path(weights_path: str, backend: str, int8: bool, fingerprint: str) -> str:
+    """Where the exported model for a backend and weights fingerprint lives; ONNX is a file, OpenVINO a directory."""
+    name = os.path.splitext(os.path.basename(weights_path))[0] + ('_int8' if int8 else '') + '_' + fingerprint
+    if backend == 'onnx':
+        return os.path.join(BACKEND_EXPORT_DIR, name + '.onnx')
+    return os.path.join(BACKEND_EXPORT_DIR, name + '_openvino_model')
+
+
+def remove_export(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def export_model(weights_path: str, backend: str, int8: bool = False, imgsz: int = BACKEND_IMAGE_SIZE,
+                 data: str = BACKEND_CALIBRATION_DATA) -> str:
+    """
+    Export a PyTorch rooftop model for a CPU inference backend, once per version of the weights file;
+    later calls return the existing export, and exports of earlier versions are removed.
+
+    ONNX models are exported with dynamic batch and image size for ONNX Runtime; with `int8` their
+    weights are then quantised dynamically with onnxruntime.quantization. OpenVINO models are exported
+    through ultralytics, which runs NNCF post-training quantisation on `data` when `int8` is set
+    (BACKEND_CALIBRATION_DATA, which should name a dataset YAML of rooftop crops).
+
+    Returns:
+        str: Path to the exported model, loadable with YOLO(path, task='segment').
+    """
+    if backend == 'torch':
+        return weights_path
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend}, expected one of {BACKENDS}")
+
+    calibrated = backend == 'openvino' and int8
+    target = export_path(weights_path, backend, int8, weights_fingerprint(weights_path, data if calibrated else ''))
+    if os.path.exists(target):
+        return target
+    os.makedirs(BACKEND_EXPORT_DIR, exist_ok=True)
+    for stale in glob.glob(export_path(weights_path, backend, int8, '[0-9a-f]' * 12)):
+        remove_export(stale)
+    if calibrated and data == DEFAULT_CALIBRATION_DATA:
+        logger.warning(f"Calibrating int8 on {data}, not rooftop imagery; set BACKEND_CALIBRATION_DATA to a rooftop dataset YAML")
+
+    model = YOLO(weights_path)
+    if backend == 'onnx':
+        exported = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+        if int8:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(exported, target, weight_type=QuantType.QUInt8)
+            # Only the quantised model is kept
+            os.remove(exported)
+        else:
+            shutil.move(exported, target)
+    else:
+        exported = model.export(format='openvino', imgsz=imgsz, dynamic=True, int8=int8, data=data)
+        shutil.move(exported, target)
+
+    logger.info(f"Exported {weights_path} for {backend}{' int8' if int8 else ''} to {target}")
+    return target
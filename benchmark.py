@@ -0,0 +1,488 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+import torch
+from automation import process_screenshots, crop_satellite_view
+from config import INFERENCE_BACKEND, INFERENCE_INT8
+from mask_encoding import CompactMasks
+from metrics import get_metrics
+from model import process_image, process_images_batch, analyze_masks, blend_masks
+from model_registry import warm_up, model_stats, get_registry
+from solar_api import process_image_with_ocr, aggregate_irradiance
+
+
+def list_images(folder):
+    return sorted(glob.glob(os.path.join(folder, '*.png')) + glob.glob(os.path.join(folder, '*.jpg')))
+
+
+def benchmark_batch(image_paths, batch_sizes, output_folder, repeats=1):
+    """
+    Compare the one-image-per-call `process_image` loop against `process_images_batch` at several batch sizes.
+
+    Returns:
+        list[dict]: One row per configuration with total seconds and images per second.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    output_paths = [os.path.join(output_folder, os.path.basename(path)) for path in image_paths]
+    rows = []
+
+    # Baseline: the existing single-image loop
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for image_path, output_path in zip(image_paths, output_paths):
+            results = process_image(image_path, output_path)
+            try:
+                analyze_masks(results, 36000)
+            except ValueError:
+                pass
+    elapsed = time.perf_counter() - start_time
+    rows.append({"mode": "single", "batch_size": 1, "seconds": elapsed,
+                 "images_per_second": len(image_paths) * repeats / elapsed})
+
+    for batch_size in batch_sizes:
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            for _ in process_images_batch(image_paths, output_paths, batch_size=batch_size):
+                pass
+        elapsed = time.perf_counter() - start_time
+        rows.append({"mode": "batch", "batch_size": batch_size, "seconds": elapsed,
+                     "images_per_second": len(image_paths) * repeats / elapsed})
+
+    return rows
+
+
+def synthetic_masks(count, height=470, width=540, seed=0):
+    """Random elliptical rooftop masks with shape (count, height, width), as float 0/1 like YOLO masks."""
+    rng = np.random.default_rng(seed)
+    masks = np.zeros((count, height, width), dtype=np.uint8)
+    for mask in masks:
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(10, 60)), int(rng.integers(10, 60)))
+        cv2.ellipse(mask, center, axes, float(rng.integers(0, 180)), 0, 360, 1, -1)
+    return torch.from_numpy(masks).float()
+
+
+def blend_masks_per_mask(image_rgb, mask_data):
+    """The previous rendering loop: one resize, full-frame allocation and blend per mask."""
+    mask_image = np.zeros_like(image_rgb)
+    for mask in mask_data:
+        mask_resized = cv2.resize(mask.cpu().numpy().astype(np.uint8) * 255, (image_rgb.shape[1], image_rgb.shape[0]))
+        mask_colored = np.zeros_like(image_rgb)
+        mask_colored[mask_resized == 255] = [255, 0, 0]
+        mask_image = cv2.addWeighted(mask_image, 1.0, mask_colored, 0.5, 0)
+    return cv2.addWeighted(image_rgb, 1.0, mask_image, 0.5, 0)
+
+
+def benchmark_overlay(mask_counts, repeats=20, height=470, width=540):
+    """
+    Latency of the per-mask rendering loop against the single-pass `blend_masks` for increasing mask counts.
+
+    Returns:
+        list[dict]: One row per mask count with mean milliseconds for each renderer.
+    """
+    image_rgb = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    rows = []
+
+    for count in mask_counts:
+        mask_data = synthetic_masks(count, height, width)
+        row = {"masks": count}
+        for name, renderer in (("per_mask_ms", blend_masks_per_mask), ("single_pass_ms", blend_masks)):
+            start_time = time.perf_counter()
+            for _ in range(repeats):
+                renderer(image_rgb, mask_data)
+            row[name] = (time.perf_counter() - start_time) * 1000 / repeats
+        row["speedup"] = row["per_mask_ms"] / row["single_pass_ms"]
+        rows.append(row)
+
+    return rows
+
+
+def dense_analysis(mask_data, points, size_of_point=20):
+    """Areas and ROI hits on the dense (C, H, W) tensor, as analyze_masks computed them before run-length encoding."""
+    areas = mask_data.sum(dim=(1, 2)).tolist()
+    hits = []
+    for x, y in points:
+        window = mask_data[:, max(0, y - size_of_point):y + size_of_point + 1, max(0, x - size_of_point):x + size_of_point + 1]
+        hit_indices = torch.nonzero((window > 0.5).flatten(1).any(dim=1)).flatten()
+        hits.append(int(hit_indices[0]) if len(hit_indices) else None)
+    return areas, hits
+
+
+def benchmark_masks(mask_counts, repeats=20, height=470, width=540):
+    """
+    Memory and latency of dense float masks against CompactMasks for increasing mask counts, checking
+    that areas, ROI hits and the decoded masks are identical.
+
+    Returns:
+        list[dict]: One row per mask count with bytes held, encode time and analysis time for each representation.
+    """
+    points = [(width // 2, height // 2), (width // 4, height // 4), (3 * width // 4, 3 * height // 4)]
+    rows = []
+
+    for count in mask_counts:
+        mask_data = synthetic_masks(count, height, width)
+
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            masks = CompactMasks.from_mask_data(mask_data)
+        encode_ms = (time.perf_counter() - start_time) * 1000 / repeats
+
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            dense_areas, dense_hits = dense_analysis(mask_data, points)
+        dense_ms = (time.perf_counter() - start_time) * 1000 / repeats
+
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            compact_areas, compact_hits = masks.areas(), masks.masks_at_points(points)
+        compact_ms = (time.perf_counter() - start_time) * 1000 / repeats
+
+        restored = CompactMasks.from_dict(json.loads(json.dumps(masks.to_dict())))
+        rows.append({
+            "masks": count,
+            "dense_bytes": mask_data.element_size() * mask_data.nelement(),
+            "compact_bytes": masks.nbytes(),
+            "json_bytes": len(json.dumps(masks.to_dict())),
+            "encode_ms": encode_ms,
+            "dense_analysis_ms": dense_ms,
+            "compact_analysis_ms": compact_ms,
+            "identical": (compact_areas == [int(area) for area in dense_areas] and compact_hits == dense_hits
+                          and np.array_equal(restored.to_dense(), mask_data.numpy().astype(np.uint8))),
+        })
+
+    return rows
+
+
+def parse_backend(spec):
+    """'onnx' or 'onnx:int8' -> ('onnx', False) or ('onnx', True)."""
+    backend, _, option = spec.partition(':')
+    return backend, option == 'int8'
+
+
+def mask_iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def matched_mask_iou(masks, reference_masks):
+    """Mean IoU of each reference mask with its best match among `masks` (0 for a missed mask)."""
+    if len(reference_masks) == 0:
+        return 1.0 if len(masks) == 0 else 0.0
+    if len(masks) == 0:
+        return 0.0
+    return float(np.mean([max(mask_iou(reference, mask) for mask in masks) for reference in reference_masks]))
+
+
+def mask_arrays(result, shape):
+    """The result's masks as booleans at the image size, so backends with different input sizes compare."""
+    if result.masks is None:
+        return np.zeros((0,) + shape, dtype=bool)
+    data = result.masks.data.cpu().numpy()
+    return np.stack([cv2.resize(mask, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST) > 0.5 for mask in data])
+
+
+def target_area(analysis):
+    target = analysis.get("target_mask") if analysis else None
+    return next(iter(target.values())) if target else 0.0
+
+
+def benchmark_backends(image_paths, specs, batch_size, repeats=1, reference='torch'):
+    """
+    Latency, throughput and parity of inference backends against the torch backend.
+
+    Every backend runs with its production predict defaults, so the parity figures are those of
+    the masks and `analyze_masks` areas the pipeline itself would get.
+
+    Returns:
+        list[dict]: One row per backend with latency, throughput, mask IoU and area deltas.
+    """
+    images = [cv2.imread(path) for path in image_paths]
+    outputs = {}
+    rows = []
+
+    for spec in [reference] + [spec for spec in specs if spec != reference]:
+        backend, int8 = parse_backend(spec)
+        loaded = get_registry().get(backend=backend, int8=int8)
+
+        # Single-image latency
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            results = [loaded.predict(image, conf=0.80, iou=0.80)[0] for image in images]
+        latency = (time.perf_counter() - start_time) / (len(images) * repeats)
+
+        # Batched throughput
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            for index in range(0, len(images), batch_size):
+                loaded.predict(images[index:index + batch_size], conf=0.80, iou=0.80)
+        throughput = len(images) * repeats / (time.perf_counter() - start_time)
+
+        analyses = []
+        for result in results:
+            try:
+                analyses.append(analyze_masks([result], 36000))
+            except ValueError:
+                analyses.append({})
+        outputs[spec] = (results, analyses)
+
+        row = {"backend": spec, "load_seconds": loaded.load_time, "latency_ms": latency * 1000,
+               "images_per_second": throughput}
+
+        if spec != reference:
+            reference_results, reference_analyses = outputs[reference]
+            union_ious, matched_ious, total_deltas, target_deltas = [], [], [], []
+            for image, result, reference_result, analysis, reference_analysis in zip(
+                    images, results, reference_results, analyses, reference_analyses):
+                masks = mask_arrays(result, image.shape[:2])
+                reference_masks = mask_arrays(reference_result, image.shape[:2])
+                union_ious.append(mask_iou(masks.any(axis=0), reference_masks.any(axis=0)))
+                matched_ious.append(matched_mask_iou(masks, reference_masks))
+                total = sum(analysis.get("all_mask_area", {}).values())
+                reference_total = sum(reference_analysis.get("all_mask_area", {}).values())
+                total_deltas.append(abs(total - reference_total) / reference_total * 100 if reference_total else 0.0)
+                target_deltas.append(abs(target_area(analysis) - target_area(reference_analysis)))
+            row.update({
+                "union_iou": float(np.mean(union_ious)),
+                "matched_iou": float(np.mean(matched_ious)),
+                "min_matched_iou": float(np.min(matched_ious)),
+                "total_area_delta_pct": float(np.mean(total_deltas)),
+                "target_area_delta_m2": float(np.mean(target_deltas)),
+            })
+        rows.append(row)
+
+    return rows
+
+
+def summarize(samples):
+    """Latency summary in milliseconds of a list of durations in seconds."""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) * 1000 / len(ordered),
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def fixture_fingerprint(paths):
+    """SHA-1 over the fixture files, so reports are only compared when they ran on the same images."""
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def synthetic_power_response(days=365, seed=0):
+    """A NASA POWER daily irradiance response with a fixed year of values, including missing (-999) days."""
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.uniform(0.5, 8.0, days), 2)
+    values[rng.choice(days, days // 50, replace=False)] = -999.0
+    return {"properties": {"parameter": {"ALLSKY_SFC_SW_DWN": {f"day{index:03d}": float(value) for index, value in enumerate(values)}}}}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "torch": torch.__version__,
+        "cuda": torch.cuda.is_available(),
+        "backend": INFERENCE_BACKEND + (' int8' if INFERENCE_INT8 else ''),
+    }
+
+
+def benchmark_suite(fixture_paths, output_folder, repeats=3, power_response=None):
+    """
+    Time the offline stages of the pipeline on fixed full-size screenshots: annotating and cropping
+    them with `process_screenshots`, segmenting the crops with `process_image`, `analyze_masks` on the
+    results, `process_image_with_ocr` on the screenshots and the irradiance aggregation of a POWER response.
+
+    Every stage runs `repeats` times over all fixtures. The report records the fixtures' fingerprint
+    and the environment so that it can be compared with a baseline from the same fixtures.
+
+    Returns:
+        dict: The environment, fixtures, per-stage latency summaries and the instrumentation snapshot.
+    """
+    screenshots_folder = os.path.join(output_folder, 'screenshots')
+    cropped_folder = os.path.join(output_folder, 'cropped')
+    overlay_folder = os.path.join(output_folder, 'overlays')
+    for folder in (cropped_folder, overlay_folder):
+        os.makedirs(folder, exist_ok=True)
+    power_response = power_response or synthetic_power_response()
+    get_metrics().reset()
+    samples = {}
+
+    def timed_call(stage, func, *args, **kwargs):
+        start_time = time.perf_counter()
+        output = func(*args, **kwargs)
+        samples.setdefault(stage, []).append(time.perf_counter() - start_time)
+        return output
+
+    for _ in range(repeats):
+        # Fresh copies each time: process_screenshots annotates the screenshots in place
+        shutil.rmtree(screenshots_folder, ignore_errors=True)
+        os.makedirs(screenshots_folder)
+        for path in fixture_paths:
+            shutil.copy(path, screenshots_folder)
+        timed_call('process_screenshots', process_screenshots, screenshots_folder, screenshots_folder, cropped_folder,
+                   incremental=False)
+
+    cropped_paths = [os.path.join(cropped_folder, os.path.basename(path)) for path in fixture_paths]
+    screenshots = [cv2.imread(path) for path in fixture_paths]
+    warm_up()
+
+    for _ in range(repeats):
+        for cropped_path in cropped_paths:
+            results = timed_call('process_image', process_image, cropped_path,
+                                 os.path.join(overlay_folder, os.path.basename(cropped_path)))
+            if results[0].masks is not None:
+                timed_call('analyze_masks', analyze_masks, results, 36000)
+        for screenshot in screenshots:
+            timed_call('process_image_with_ocr', process_image_with_ocr, screenshot, 788, 605, 2000, 200, None)
+            timed_call('crop_satellite_view', lambda image: np.ascontiguousarray(crop_satellite_view(image)[0]), screenshot)
+        timed_call('aggregate_irradiance', aggregate_irradiance, power_response)
+
+    return {
+        "environment": environment(),
+        "fixtures": {"count": len(fixture_paths), "sha1": fixture_fingerprint(fixture_paths)},
+        "repeats": repeats,
+        "stages": {stage: summarize(values) for stage, values in samples.items()},
+        "metrics": get_metrics().snapshot(),
+    }
+
+
+def compare_reports(report, baseline, tolerance):
+    """
+    Per-stage rows of the report against a baseline report; a stage regresses when its mean is
+    more than `tolerance` (a fraction) slower than the baseline's.
+    """
+    if baseline.get("fixtures", {}).get("sha1") != report["fixtures"]["sha1"]:
+        print("Warning: the baseline was measured on different fixtures")
+    rows = []
+    for stage, summary in report["stages"].items():
+        row = {"stage": stage, **summary}
+        reference = baseline.get("stages", {}).get(stage)
+        if reference:
+            row["baseline_mean_ms"] = reference["mean_ms"]
+            row["change_pct"] = (summary["mean_ms"] / reference["mean_ms"] - 1) * 100 if reference["mean_ms"] else 0.0
+            row["regression"] = summary["mean_ms"] > reference["mean_ms"] * (1 + tolerance)
+        rows.append(row)
+    return rows
+
+
+def print_rows(rows):
+    for row in rows:
+        print("  ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                        for key, value in row.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rooftop pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = subparsers.add_parser('batch', help="Throughput of batched segmentation against the single-image loop")
+    batch_parser.add_argument('--folder', required=True, help="Folder of cropped satellite images")
+    batch_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    batch_parser.add_argument('--output', default=os.path.join('benchmark_output', 'batch'))
+    batch_parser.add_argument('--repeats', type=int, default=1)
+
+    overlay_parser = subparsers.add_parser('overlay', help="Overlay rendering latency against mask count")
+    overlay_parser.add_argument('--mask-counts', type=int, nargs='+', default=[1, 5, 10, 25, 50, 100])
+    overlay_parser.add_argument('--repeats', type=int, default=20)
+
+    suite_parser = subparsers.add_parser('suite', help="Reproducible timings of the offline stages on fixture screenshots")
+    suite_parser.add_argument('--fixtures', default='benchmark_fixtures', help="Folder of full-size Google Earth screenshots")
+    suite_parser.add_argument('--output', default=os.path.join('benchmark_output', 'suite'))
+    suite_parser.add_argument('--repeats', type=int, default=3)
+    suite_parser.add_argument('--power-response', help="Recorded NASA POWER JSON response; a fixed synthetic year by default")
+    suite_parser.add_argument('--baseline', help="Earlier suite report (--json) to compare against")
+    suite_parser.add_argument('--tolerance', type=float, default=0.2,
+                              help="Fraction by which a stage's mean may exceed the baseline before it is a regression")
+
+    masks_parser = subparsers.add_parser('masks', help="Memory and analysis latency of dense against run-length encoded masks")
+    masks_parser.add_argument('--mask-counts', type=int, nargs='+', default=[1, 5, 10, 25, 50, 100])
+    masks_parser.add_argument('--repeats', type=int, default=20)
+
+    backends_parser = subparsers.add_parser('backends', help="Latency, throughput and parity of inference backends")
+    backends_parser.add_argument('--folder', required=True, help="Folder of cropped satellite images")
+    backends_parser.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx:int8', 'openvino', 'openvino:int8'])
+    backends_parser.add_argument('--batch-size', type=int, default=8)
+    backends_parser.add_argument('--repeats', type=int, default=1)
+    backends_parser.add_argument('--min-iou', type=float, default=None,
+                                 help="Exit with an error if any backend's mean matched mask IoU falls below this")
+
+    parser.add_argument('--json', help="Also write the report to this JSON file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == 'batch':
+        warm_up()
+        image_paths = list_images(args.folder)
+        if not image_paths:
+            parser.error(f"No images found in {args.folder}")
+        rows = benchmark_batch(image_paths, args.batch_sizes, args.output, args.repeats)
+    elif args.command == 'overlay':
+        rows = benchmark_overlay(args.mask_counts, args.repeats)
+    elif args.command == 'suite':
+        fixture_paths = list_images(args.fixtures)
+        if not fixture_paths:
+            parser.error(f"No images found in {args.fixtures}")
+        power_response = None
+        if args.power_response:
+            with open(args.power_response) as f:
+                power_response = json.load(f)
+        suite_report = benchmark_suite(fixture_paths, args.output, args.repeats, power_response)
+        baseline = {}
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        rows = compare_reports(suite_report, baseline, args.tolerance)
+    elif args.command == 'masks':
+        rows = benchmark_masks(args.mask_counts, args.repeats)
+    elif args.command == 'backends':
+        image_paths = list_images(args.folder)
+        if not image_paths:
+            parser.error(f"No images found in {args.folder}")
+        rows = benchmark_backends(image_paths, args.backends, args.batch_size, args.repeats)
+
+    print_rows(rows)
+    print(f"Model stats: {model_stats()}")
+
+    if args.json:
+        report = {"command": args.command, "rows": rows, "model": model_stats()}
+        if args.command == 'suite':
+            report.update(suite_report)
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+    if args.command == 'suite' and any(row.get("regression") for row in rows):
+        print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(row['stage'] for row in rows if row.get('regression'))}")
+        sys.exit(1)
+
+    if args.command == 'backends' and args.min_iou is not None:
+        failing = [row["backend"] for row in rows if row.get("matched_iou", 1.0) < args.min_iou]
+        if failing:
+            print(f"Parity below IoU {args.min_iou}: {', '.join(failing)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
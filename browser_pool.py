@@ -0,0 +1,218 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import psutil
+from automation import create_configured_driver, reset_search
+from config import (BROWSER_POOL_SIZE, BROWSER_MAX_USES, BROWSER_MAX_MEMORY_MB, BROWSER_START_RETRIES,
+                    BROWSER_START_BACKOFF, BROWSER_LEASE_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+
+class PooledDriver:
+    """A browser owned by the pool, with the bookkeeping used to decide when to recycle it."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.created_at = time.time()
+        self.uses = 0
+
+
+class BrowserPool:
+    """
+    Keeps `size` headless Firefox sessions alive, already on Google Earth with layers configured.
+
+    Requests lease a driver with `with pool.lease() as driver:`. On return the driver is reset for
+    the next search, or recycled (quit and replaced) if it crashed, failed its health check, exceeded
+    `max_uses` searches or grew beyond `max_memory_mb` of resident memory.
+
+    A browser that fails to start is retried `start_retries` times with exponential backoff. If it
+    still fails, its slot is left empty and refilled by the next lease, so the pool never shrinks for good.
+    """
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_MAX_USES,
+                 max_memory_mb: float = BROWSER_MAX_MEMORY_MB, factory=create_configured_driver,
+                 start_retries: int = BROWSER_START_RETRIES, start_backoff: float = BROWSER_START_BACKOFF):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_memory_mb = max_memory_mb
+        self.factory = factory
+        self.start_retries = start_retries
+        self.start_backoff = start_backoff
+
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.live = 0  # Browsers idle, leased or starting
+
+        self.started_at = time.time()
+        self.in_use = 0
+        self.leases = 0
+        self.recycled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.busy_time = 0.0
+
+    def start(self):
+        """Start all browsers in parallel; browser startup dominates, so this takes about one startup."""
+        threads = self._fill()
+        for thread in threads:
+            thread.join()
+        self.started_at = time.time()
+        return self
+
+    def _fill(self):
+        """Start browsers in the background for every empty slot. Returns the starting threads."""
+        with self._lock:
+            missing = 0 if self._closed else self.size - self.live
+            self.live += max(missing, 0)
+        threads = [threading.Thread(target=self._add_driver, daemon=True) for _ in range(missing)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _add_driver(self):
+        """Start a browser into an already reserved slot, retrying with backoff; the slot is freed if every attempt fails."""
+        for attempt in range(self.start_retries + 1):
+            if self._closed:
+                break
+            try:
+                pooled = PooledDriver(self.factory())
+            except Exception as e:
+                logger.error(f"Error starting pooled browser (attempt {attempt + 1} of {self.start_retries + 1}): {e}")
+                if attempt < self.start_retries:
+                    time.sleep(self.start_backoff * 2 ** attempt)
+                continue
+
+            if self._closed:
+                self._quit(pooled)
+                break
+            self._idle.put(pooled)
+            return
+
+        with self._lock:
+            self.live -= 1
+
+    def _quit(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            logger.error(f"Error closing pooled browser: {e}")
+
+    def _recycle(self, pooled):
+        self._quit(pooled)
+        with self._lock:
+            self.recycled += 1
+            if self._closed:
+                self.live -= 1
+                return
+        # Replace in the background, into the same slot, so the request that returned the browser is not held up
+        threading.Thread(target=self._add_driver, daemon=True).start()
+
+    def memory_mb(self, pooled):
+        """Resident memory of the geckodriver process and the Firefox processes below it."""
+        try:
+            process = psutil.Process(pooled.driver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+        except (psutil.Error, AttributeError):
+            return None
+
+    def is_healthy(self, pooled):
+        try:
+            ready_state = pooled.driver.execute_script("return document.readyState")
+        except Exception:
+            return False
+        if ready_state != 'complete':
+            return False
+        if pooled.uses >= self.max_uses:
+            return False
+        memory = self.memory_mb(pooled)
+        if self.max_memory_mb and memory is not None and memory > self.max_memory_mb:
+            logger.info(f"Recycling browser using {memory:.0f} MB")
+            return False
+        return True
+
+    @contextmanager
+    def lease(self, timeout: float = BROWSER_LEASE_TIMEOUT):
+        """
+        Lease a ready browser for one search, first restarting browsers whose slots were left empty.
+
+        Raises:
+            TimeoutError: If no browser becomes free within `timeout` seconds.
+        """
+        if self._closed:
+            raise RuntimeError("Browser pool is closed")
+
+        self._fill()
+        wait_start = time.perf_counter()
+        try:
+            pooled = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No browser became free within {timeout} seconds") from None
+        waited = time.perf_counter() - wait_start
+
+        with self._lock:
+            self.in_use += 1
+            self.leases += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        lease_start = time.perf_counter()
+        failed = False
+        try:
+            yield pooled.driver
+        except Exception:
+            failed = True
+            raise
+        finally:
+            pooled.uses += 1
+            with self._lock:
+                self.in_use -= 1
+                self.busy_time += time.perf_counter() - lease_start
+            self._release(pooled, failed)
+
+    def _release(self, pooled, failed):
+        if self._closed:
+            self._quit(pooled)
+            with self._lock:
+                self.live -= 1
+            return
+
+        if not failed and self.is_healthy(pooled):
+            try:
+                reset_search(pooled.driver)
+                self._idle.put(pooled)
+                return
+            except Exception as e:
+                logger.error(f"Error resetting pooled browser: {e}")
+
+        self._recycle(pooled)
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            return {
+                "size": self.size,
+                "live": self.live,
+                "idle": self._idle.qsize(),
+                "in_use": self.in_use,
+                "leases": self.leases,
+                "recycled": self.recycled,
+                "mean_wait": self.total_wait / self.leases if self.leases else 0.0,
+                "max_wait": self.max_wait,
+                "utilisation": self.busy_time / (self.size * elapsed) if elapsed > 0 and self.size else 0.0,
+            }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(pooled)
+            with self._lock:
+                self.live -= 1
@@ -1,8 +1,114 @@
 import os
 
-def get_paths(timestamp):
-    current_run_path = os.path.join('model', str(timestamp))
-    os.makedirs(current_run_path, exist_ok=True)
+# Segmentation model
+MODEL_WEIGHTS = 'rooftop_model.pt'
+WARMUP_IMAGE_SIZE = (470, 540)  # (height, width) of the cropped satellite image
+BATCH_SIZE = 8  # Images per forward pass in process_images_batch
+
+# Inference backend: 'torch' (eager PyTorch), 'onnx' (ONNX Runtime) or 'openvino', on CPU
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+INFERENCE_INT8 = os.environ.get('INFERENCE_INT8', '0') == '1'  # Quantise the exported model to int8
+BACKEND_EXPORT_DIR = 'exported_models'
+BACKEND_IMAGE_SIZE = 640  # Export image size
+DEFAULT_CALIBRATION_DATA = 'coco8-seg.yaml'
+# Dataset YAML for OpenVINO int8 calibration. The COCO sample is only a fallback: point this at rooftop crops
+BACKEND_CALIBRATION_DATA = os.environ.get('BACKEND_CALIBRATION_DATA', DEFAULT_CALIBRATION_DATA)
+
+# Mask encoding
+MASK_THRESHOLD = 0.5  # Mask values above this are rooftop pixels
+MASK_POLYGON_TOLERANCE = 1.0  # Maximum distance in pixels between a mask outline and its simplified polygon
+
+# Browser pool
+BROWSER_POOL_SIZE = 2  # Warm Google Earth sessions kept alive
+BROWSER_MAX_USES = 50  # Searches before a browser is recycled
+BROWSER_MAX_MEMORY_MB = 2048  # Recycle a browser whose processes grow beyond this
+BROWSER_START_RETRIES = 3  # Further attempts to start a pooled browser after a failed start
+BROWSER_START_BACKOFF = 5  # Seconds before the first retry, doubling for each further one
+BROWSER_LEASE_TIMEOUT = 300  # Seconds a request waits for a free browser before failing
+
+# Readiness waits: upper bounds in seconds per stage; the waits return as soon as the page or view is ready
+READINESS_TIMEOUTS = {
+    'page_load': 30,
+    'globe_render': 20,
+    'panel': 3,
+    'layer_style': 5,
+    'search_box': 5,
+    'search_results': 45,
+    'marker_hidden': 3,
+    'tile': 30,
+}
+STABLE_VIEW_INTERVAL = 0.5  # Seconds between viewport grabs
+STABLE_VIEW_THRESHOLD = 1.0  # Mean absolute grayscale difference below which two grabs count as identical
+# Consecutive identical grabs needed to call the view settled, per stage. After a search the view must
+# stay still for longer, so a pause between the search box closing and the fly-to starting is not taken for the end
+STABLE_VIEW_FRAMES = {
+    'default': 2,
+    'search_results': 6,
+}
+WAIT_HISTORY_SIZE = 500  # Most recent readiness waits per stage kept for wait statistics
+
+# Screenshot pipeline
+IN_MEMORY_PIPELINE = True  # Keep screenshots and crops in memory instead of round-tripping PNGs through disk
+ARCHIVE_ARTIFACTS = False  # In in-memory mode, also write screenshots, crops and overlays for debugging
+SCREENSHOT_WORKERS = 4  # Threads annotating and cropping screenshots on disk
+
+# NASA POWER irradiance
+POWER_API_URL = os.environ.get('POWER_API_URL', "https://power.larc.nasa.gov/api/temporal/daily/point")
+HTTP_TIMEOUT = (5, 30)  # (connect, read) seconds
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_POOL_SIZE = 8
+IRRADIANCE_CACHE_PATH = os.path.join('cache', 'irradiance.sqlite')
+IRRADIANCE_GRID_RESOLUTION = 0.01  # Degrees; about 1 km, well inside one POWER grid cell
+IRRADIANCE_CACHE_TTL = 7 * 24 * 3600  # Seconds
+IRRADIANCE_CACHE_MAX_ENTRIES = 100000
+
+# Stage graph
+PIPELINE_WORKERS = 2  # Threads per request; segmentation and coordinates/irradiance run side by side
+
+# Job queue
+JOB_WORKERS = BROWSER_POOL_SIZE  # Concurrent requests; one browser each
+JOB_QUEUE_SIZE = 20  # Waiting requests beyond which new ones are turned away
+JOB_HISTORY_SIZE = 200  # Finished jobs kept for polling and latency metrics
+JOB_POLL_INTERVAL = 1.0  # Seconds between progress updates in the UI
+
+# Result cache
+RESULT_CACHE_DIR = os.path.join('cache', 'results')
+RESULT_CACHE_TTL = 30 * 24 * 3600  # Seconds
+RESULT_CACHE_MAX_ENTRIES = 5000
+RESULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # Overlay images plus JSON
+
+# Rooftop index
+ROOFTOP_INDEX_PATH = os.path.join('cache', 'rooftops.sqlite')
+ROOFTOP_INDEX_MAX_AGE = 180 * 24 * 3600  # Seconds; older captures no longer answer requests and are pruned
+ROOFTOP_INDEX_EDGE_MARGIN = 40  # Pixels; a capture only answers points at least this far inside its crop
+ROOFTOP_INDEX_MAX_TILT = 5  # Degrees; more tilted views cannot be geo-referenced from the camera URL
+
+# Metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Histogram upper bounds, seconds
+METRICS_EXPORT_DIR = 'metrics'  # metrics.json and metrics.prom are written here
+METRICS_PREFIX = 'rooftop'
+
+# Record and replay of the browser and NASA POWER calls
+REPLAY_ARCHIVE_DIR = 'recordings'  # One zip archive per place
+REPLAY_LATENCY_SCALE = float(os.environ.get('REPLAY_LATENCY_SCALE', '1.0'))  # 1 replays recorded timings, 0 runs at full speed
+
+# Area scanning
+SCAN_METRES_PER_PIXEL = (36000 / (540 * 470)) ** 0.5  # Ground resolution at which a crop covers the usual 36000 m2
+SCAN_VIEWPORT_SIZE = (1280, 720)  # Browser window (width, height) in pixels
+SCAN_FIELD_OF_VIEW = 35  # Vertical field of view of the Earth camera, degrees
+SCAN_TILE_OVERLAP = 0.25  # Fraction of a tile shared with each neighbour
+SCAN_MERGE_IOU = 0.3  # Polygons from different tiles with at least this IoU are one rooftop
+SCAN_MERGE_CONTAINMENT = 0.7  # ... as are polygons mostly inside another (roofs cut by a tile edge)
+
+def run_path(timestamp):
+    """The working directory of a run under model/."""
+    return os.path.join('model', str(timestamp))
+
+def get_paths(timestamp, create=True):
+    """The artefact folders of a run; with `create` False they are only named, not created."""
+    current_run_path = run_path(timestamp)
     
     paths = {
         'run_screenshot': os.path.join(current_run_path, "run_screenshot"),
@@ -14,7 +120,8 @@ def get_paths(timestamp):
 
     }
 
-    for path in paths.values():
-        os.makedirs(path, exist_ok=True)
+    if create:
+        for path in paths.values():
+            os.makedirs(path, exist_ok=True)
 
     return paths
@@ -0,0 +1,53 @@
+import math
+from config import SCAN_METRES_PER_PIXEL, SCAN_VIEWPORT_SIZE, SCAN_FIELD_OF_VIEW
+
+METRES_PER_DEGREE = 111320.0
+
+# The satellite crop inside the viewport, as cut by crop_satellite_view
+CROP_WIDTH, CROP_HEIGHT = 540, 470
+CROP_CENTER_X, CROP_CENTER_Y = 640, 315
+
+
+def camera_distance(metres_per_pixel=SCAN_METRES_PER_PIXEL):
+    """Camera distance giving `metres_per_pixel` on the ground for the viewport height and vertical field of view."""
+    viewport_height = SCAN_VIEWPORT_SIZE[1]
+    return metres_per_pixel * viewport_height / (2 * math.tan(math.radians(SCAN_FIELD_OF_VIEW / 2)))
+
+
+def ground_resolution(distance, field_of_view=SCAN_FIELD_OF_VIEW):
+    """Metres per pixel seen by a camera looking straight down from `distance` metres; the inverse of camera_distance."""
+    return distance * 2 * math.tan(math.radians(field_of_view / 2)) / SCAN_VIEWPORT_SIZE[1]
+
+
+class LocalFrame:
+    """Equirectangular projection to metres east and north of an origin; accurate over district-sized areas."""
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.metres_per_degree_lon = METRES_PER_DEGREE * math.cos(math.radians(latitude))
+
+    def to_metres(self, latitude, longitude):
+        return ((longitude - self.longitude) * self.metres_per_degree_lon,
+                (latitude - self.latitude) * METRES_PER_DEGREE)
+
+    def to_degrees(self, x, y):
+        return (self.latitude + y / METRES_PER_DEGREE,
+                self.longitude + x / self.metres_per_degree_lon)
+
+
+def crop_to_metres(x, y, metres_per_pixel=SCAN_METRES_PER_PIXEL):
+    """
+    A pixel of the satellite crop as metres east and north of the point the camera looks at, which
+    is the centre of the viewport.
+    """
+    screen_x = x + CROP_CENTER_X - CROP_WIDTH / 2
+    screen_y = y + CROP_CENTER_Y - CROP_HEIGHT / 2
+    return ((screen_x - SCAN_VIEWPORT_SIZE[0] / 2) * metres_per_pixel,
+            (SCAN_VIEWPORT_SIZE[1] / 2 - screen_y) * metres_per_pixel)
+
+
+def crop_to_degrees(points, latitude, longitude, metres_per_pixel=SCAN_METRES_PER_PIXEL):
+    """Satellite crop pixels (x, y) as (latitude, longitude), for a camera looking straight down at the given point."""
+    frame = LocalFrame(latitude, longitude)
+    return [frame.to_degrees(*crop_to_metres(x, y, metres_per_pixel)) for x, y in points]
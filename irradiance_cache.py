@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+import time
+from config import IRRADIANCE_CACHE_PATH, IRRADIANCE_GRID_RESOLUTION, IRRADIANCE_CACHE_TTL, IRRADIANCE_CACHE_MAX_ENTRIES
+
+
+class IrradianceCache:
+    """
+    Persistent cache of yearly irradiance per lat/long grid cell, stored in SQLite.
+
+    Coordinates are snapped to a grid of `resolution` degrees, so nearby queries share an entry.
+    Entries older than `ttl` seconds are treated as missing, and once more than `max_entries`
+    are stored the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str = IRRADIANCE_CACHE_PATH, resolution: float = IRRADIANCE_GRID_RESOLUTION,
+                 ttl: float = IRRADIANCE_CACHE_TTL, max_entries: int = IRRADIANCE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.resolution = resolution
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS irradiance ("
+            " latitude REAL, longitude REAL, average REAL, total REAL,"
+            " created_at REAL, accessed_at REAL, PRIMARY KEY (latitude, longitude))")
+        self._connection.commit()
+
+    def snap(self, latitude: float, longitude: float) -> tuple:
+        """The centre of the grid cell containing the point, rounded to avoid float noise in the key."""
+        return (round(round(latitude / self.resolution) * self.resolution, 6),
+                round(round(longitude / self.resolution) * self.resolution, 6))
+
+    def get(self, latitude: float, longitude: float):
+        """Returns (average, total) for the point's grid cell, or None if missing or expired."""
+        key = self.snap(latitude, longitude)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT average, total, created_at FROM irradiance WHERE latitude = ? AND longitude = ?", key).fetchone()
+            if row is None or now - row[2] > self.ttl:
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                "UPDATE irradiance SET accessed_at = ? WHERE latitude = ? AND longitude = ?", (now, *key))
+            self._connection.commit()
+            self.hits += 1
+            return row[0], row[1]
+
+    def put(self, latitude: float, longitude: float, average: float, total: float):
+        key = self.snap(latitude, longitude)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO irradiance VALUES (?, ?, ?, ?, ?, ?)", (*key, average, total, now, now))
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        self._connection.execute("DELETE FROM irradiance WHERE created_at < ?", (time.time() - self.ttl,))
+        count = self._connection.execute("SELECT COUNT(*) FROM irradiance").fetchone()[0]
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM irradiance WHERE rowid IN"
+                " (SELECT rowid FROM irradiance ORDER BY accessed_at LIMIT ?)", (count - self.max_entries,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM irradiance").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM irradiance")
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_irradiance_cache() -> IrradianceCache:
+    """The process-wide cache, opened on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = IrradianceCache()
+        return _cache
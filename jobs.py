@@ -0,0 +1,190 @@
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+from config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_HISTORY_SIZE, run_path
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+def normalize_place_name(place_name: str) -> str:
+    """Case- and whitespace-insensitive form of a place name, used to spot duplicate requests."""
+    return re.sub(r'\s+', ' ', place_name).strip().lower()
+
+
+class Job:
+    """One queued request. `status` moves from queued to running to done or failed."""
+
+    def __init__(self, place_name: str, refresh: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.place_name = place_name
+        self.refresh = refresh
+        self.key = normalize_place_name(place_name)
+        # Working directory under model/, isolated per job so concurrent requests never share files. It is
+        # only created if the job writes files, and removed once the job leaves the queue's history
+        self.timestamp = os.path.join('jobs', self.id)
+        self.status = 'queued'
+        self.stage = None
+        self.stages_done = []
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def progress(self, stage: str, ok: bool):
+        """Stage callback: records a finished stage."""
+        self.stages_done.append(stage)
+        self.stage = stage
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def status_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "place_name": self.place_name,
+            "status": self.status,
+            "stage": self.stage,
+            "stages_done": list(self.stages_done),
+            "error": str(self.error) if self.error is not None else None,
+            "wait_seconds": (self.started_at or time.time()) - self.submitted_at,
+            "run_seconds": (self.finished_at or time.time()) - self.started_at if self.started_at else None,
+        }
+
+
+class JobQueue:
+    """
+    A bounded queue of place requests served by a fixed number of worker threads.
+
+    `worker_fn(job)` does the work and returns the result. Submitting a place that is already
+    queued or running returns the in-flight job instead of queueing it again, unless the new request
+    is a refresh and the in-flight job is not: a refresh must not be answered from a cache. Submitting when
+    `max_queue` jobs are waiting raises QueueFullError, so a burst of users queues up in front of a
+    fixed number of browsers and model calls instead of piling more of them up.
+    """
+
+    def __init__(self, worker_fn, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_SIZE,
+                 history_size: int = JOB_HISTORY_SIZE):
+        self.worker_fn = worker_fn
+        self.workers = workers
+        self.history_size = history_size
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._in_flight = {}
+        self._finished_order = []
+
+        self.completed = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.wait_times = []
+        self.run_times = []
+
+        self._threads = [threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, place_name: str, refresh: bool = False) -> Job:
+        key = normalize_place_name(place_name)
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None and (in_flight.refresh or not refresh):
+                self.deduplicated += 1
+                return in_flight
+
+            job = Job(place_name, refresh)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(f"Job queue is full ({self._queue.maxsize} waiting)")
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+        return job
+
+    def get(self, job_id: str) -> Job:
+        return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> int:
+        """Number of queued jobs ahead of `job`, or 0 once it is running."""
+        if job.status != 'queued':
+            return 0
+        with self._queue.mutex:
+            waiting = list(self._queue.queue)
+        return waiting.index(job) if job in waiting else 0
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                job.result = self.worker_fn(job)
+                job.status = 'done'
+            except Exception as e:
+                job.error = e
+                job.status = 'failed'
+                logger.error(f"Job {job.id} for {job.place_name} failed: {e}")
+            job.finished_at = time.time()
+
+            with self._lock:
+                # A refresh queued behind a non-refresh job for the same place has taken its in-flight slot
+                if self._in_flight.get(job.key) is job:
+                    self._in_flight.pop(job.key)
+                if job.status == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.wait_times.append(job.started_at - job.submitted_at)
+                self.run_times.append(job.finished_at - job.started_at)
+                self.wait_times = self.wait_times[-self.history_size:]
+                self.run_times = self.run_times[-self.history_size:]
+
+                # Keep finished jobs pollable for a while, then forget them
+                self._finished_order.append(job.id)
+                expired = []
+                while len(self._finished_order) > self.history_size:
+                    expired.append(self._jobs.pop(self._finished_order.pop(0), None))
+
+            job._done.set()
+            for expired_job in expired:
+                if expired_job is not None:
+                    shutil.rmtree(run_path(expired_job.timestamp), ignore_errors=True)
+            self._queue.task_done()
+
+    def stats(self) -> dict:
+        def summary(values):
+            if not values:
+                return {"mean": None, "p95": None, "max": None}
+            ordered = sorted(values)
+            return {"mean": sum(ordered) / len(ordered),
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max": ordered[-1]}
+
+        with self._lock:
+            running = sum(1 for job in self._in_flight.values() if job.status == 'running')
+            return {
+                "queue_depth": self._queue.qsize(),
+                "running": running,
+                "workers": self.workers,
+                "completed": self.completed,
+                "failed": self.failed,
+                "deduplicated": self.deduplicated,
+                "wait_seconds": summary(self.wait_times),
+                "run_seconds": summary(self.run_times),
+            }
@@ -0,0 +1,198 @@
+import base64
+import zlib
+import cv2
+import numpy as np
+from config import MASK_THRESHOLD, MASK_POLYGON_TOLERANCE
+
+
+def encode_counts(counts) -> str:
+    """Run lengths as a short ASCII string: zlib-compressed little-endian uint32, base64 encoded."""
+    return base64.b64encode(zlib.compress(np.asarray(counts, dtype='<u4').tobytes())).decode('ascii')
+
+
+def decode_counts(encoded: str) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(base64.b64decode(encoded)), dtype='<u4').astype(np.int64)
+
+
+class CompactMasks:
+    """
+    The segmentation masks of one image as row-major run-length encodings.
+
+    The foreground runs of all masks are kept in two flat arrays, their start offsets in the flattened
+    (H, W) mask and their lengths, ordered by mask and then by offset; mask i owns the runs from
+    `offsets[i]` to `offsets[i + 1]`. A rooftop costs a few integers per image row instead of a float
+    per pixel, and areas and ROI hits are computed on the flat arrays for all masks at once. Dense
+    masks are only rebuilt on demand, e.g. for an overlay. Alongside the runs, the simplified outline
+    and bounding box of each mask are kept in image pixels.
+    """
+
+    def __init__(self, size, starts, lengths, offsets, polygons=None, boxes=None):
+        """
+        Parameters:
+            size (tuple[int, int]): (height, width) of the masks.
+            starts (np.ndarray): Start offset of every foreground run, by mask and then offset.
+            lengths (np.ndarray): Length of every foreground run.
+            offsets (np.ndarray): Index of each mask's first run, plus the total number of runs at the end.
+            polygons (list | None): Per mask, its simplified outline as [[x, y], ...] in image pixels.
+            boxes (list | None): Per mask, its bounding box as [x1, y1, x2, y2] in image pixels.
+        """
+        self.size = tuple(size)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        count = len(self.offsets) - 1
+        self.polygons = polygons if polygons is not None else [[] for _ in range(count)]
+        self.boxes = boxes if boxes is not None else [None] * count
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def empty(cls, size):
+        return cls(size, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64), [], [])
+
+    @classmethod
+    def from_mask_data(cls, mask_data, threshold: float = MASK_THRESHOLD, polygons=None, boxes=None):
+        """
+        Encode a (C, H, W) tensor or array of masks.
+
+        The masks are thresholded where they are (on the GPU for CUDA tensors) and only the boolean
+        masks are copied to the host, where the run boundaries of all masks are found in one pass.
+        """
+        count, height, width = mask_data.shape
+        if count == 0:
+            return cls.empty((height, width))
+        binary = mask_data > threshold
+        if hasattr(binary, 'cpu'):
+            binary = binary.cpu().numpy()
+
+        padded = np.zeros((count, height * width + 2), dtype=np.int8)
+        padded[:, 1:-1] = binary.reshape(count, -1)
+        mask_index, position = np.nonzero(np.diff(padded, axis=1))
+
+        # Boundaries come out ordered by mask, then offset, alternating run start and run end
+        starts = position[0::2].astype(np.int64)
+        lengths = position[1::2] - starts
+        offsets = np.searchsorted(mask_index[0::2], np.arange(count + 1))
+        return cls((height, width), starts, lengths, offsets, polygons, boxes)
+
+    @classmethod
+    def from_result(cls, result, threshold: float = MASK_THRESHOLD, tolerance: float = MASK_POLYGON_TOLERANCE):
+        """
+        Encode the masks of one YOLO result, with their outlines simplified to within `tolerance`
+        pixels. Returns None if the result has no masks.
+        """
+        if result.masks is None:
+            return None
+
+        polygons = []
+        for points in result.masks.xy:
+            if len(points) >= 3 and tolerance:
+                points = cv2.approxPolyDP(np.asarray(points, dtype=np.float32).reshape(-1, 1, 2), tolerance, True).reshape(-1, 2)
+            polygons.append(np.round(np.asarray(points, dtype=np.float64), 1).tolist())
+
+        boxes = result.boxes.xyxy.int().tolist() if result.boxes is not None else None
+        return cls.from_mask_data(result.masks.data, threshold, polygons, boxes)
+
+    def areas(self) -> list:
+        """Foreground pixel count of each mask."""
+        # Differences of the running total at the mask boundaries; unlike reduceat, right for masks without runs
+        totals = np.concatenate(([0], np.cumsum(self.lengths)))
+        return (totals[self.offsets[1:]] - totals[self.offsets[:-1]]).tolist()
+
+    def masks_at_points(self, points, size_of_point: int = 20) -> list:
+        """
+        Find, for each query point, the first mask that covers any pixel in the window around it.
+
+        Each row of the window is one offset interval. Shifting every mask's offsets by mask index
+        times the image size makes the flat run arrays globally sorted, so the intervals of all masks
+        are looked up with a single binary search per point.
+
+        Parameters:
+            points (list[tuple[int, int]]): Query points as (x, y) pixel coordinates.
+            size_of_point (int): Half size of the square window around each point.
+
+        Returns:
+            list[int | None]: Zero-based mask index per point, or None where no mask is hit.
+        """
+        height, width = self.size
+        count = len(self)
+        total = height * width
+        run_mask = np.repeat(np.arange(count, dtype=np.int64), np.diff(self.offsets))
+        global_starts = run_mask * total + self.starts
+        global_ends = global_starts + self.lengths
+        mask_base = np.arange(count, dtype=np.int64)[:, None] * total
+        hits = []
+
+        for x, y in points:
+            x_min = max(0, x - size_of_point)
+            x_max = min(width, x + size_of_point + 1)
+            y_min = max(0, y - size_of_point)
+            y_max = min(height, y + size_of_point + 1)
+            if x_min >= x_max or y_min >= y_max or not len(global_starts):
+                hits.append(None)
+                continue
+
+            # (masks, rows) intervals; the first run ending after an interval starts overlaps it if it also
+            # starts before its end, which a run of a later mask never does
+            row_starts = mask_base + (np.arange(y_min, y_max) * width + x_min)
+            row_ends = row_starts + (x_max - x_min)
+            candidates = np.searchsorted(global_ends, row_starts, side='right')
+            found = candidates < len(global_starts)
+            overlaps = found & (global_starts[np.minimum(candidates, len(global_starts) - 1)] < row_ends)
+            hit = overlaps.any(axis=1)
+            hits.append(int(np.argmax(hit)) if hit.any() else None)
+
+        return hits
+
+    def _fill(self, starts, lengths) -> np.ndarray:
+        height, width = self.size
+        delta = np.zeros(height * width + 1, dtype=np.int32)
+        np.add.at(delta, starts, 1)
+        np.add.at(delta, starts + lengths, -1)
+        return np.cumsum(delta[:-1]).reshape(height, width)
+
+    def overlap_counts(self) -> np.ndarray:
+        """Number of masks covering each pixel, as a (H, W) uint8 map, built without any dense per-mask array."""
+        return np.minimum(self._fill(self.starts, self.lengths), 255).astype(np.uint8)
+
+    def decode(self, index: int) -> np.ndarray:
+        """One mask as a dense (H, W) uint8 array of 0 and 1."""
+        runs = slice(self.offsets[index], self.offsets[index + 1])
+        return self._fill(self.starts[runs], self.lengths[runs]).astype(np.uint8)
+
+    def to_dense(self) -> np.ndarray:
+        """All masks as a dense (C, H, W) uint8 array. Only for callers that really need per-pixel masks."""
+        if not len(self):
+            return np.zeros((0,) + self.size, dtype=np.uint8)
+        return np.stack([self.decode(index) for index in range(len(self))])
+
+    def nbytes(self) -> int:
+        """Memory held by the run arrays."""
+        return self.starts.nbytes + self.lengths.nbytes + self.offsets.nbytes
+
+    def to_dict(self) -> dict:
+        """
+        JSON-serialisable form: per mask, the alternating background and foreground run lengths
+        (starting with background, as in COCO RLE but row-major), compressed; plus outlines and boxes.
+        """
+        total = self.size[0] * self.size[1]
+        edges = np.empty(2 * len(self.starts), dtype=np.int64)
+        edges[0::2] = self.starts
+        edges[1::2] = self.starts + self.lengths
+        counts = [encode_counts(np.diff(np.concatenate(([0], mask_edges, [total]))))
+                  for mask_edges in np.split(edges, 2 * self.offsets[1:-1])] if len(self) else []
+        return {"size": list(self.size), "counts": counts, "polygons": self.polygons, "boxes": self.boxes}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        starts, lengths, offsets = [], [], [0]
+        for encoded in data["counts"]:
+            edges = np.cumsum(decode_counts(encoded))[:-1]
+            starts.append(edges[0::2])
+            lengths.append(edges[1::2] - edges[0::2])
+            offsets.append(offsets[-1] + len(edges) // 2)
+        if not starts:
+            return cls.empty(data["size"])
+        return cls(data["size"], np.concatenate(starts), np.concatenate(lengths), offsets,
+                   data.get("polygons"), data.get("boxes"))
@@ -0,0 +1,223 @@
+import bisect
+import functools
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from config import METRICS_ENABLED, METRIC_BUCKETS, METRICS_EXPORT_DIR, METRICS_PREFIX
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout, plus exact count, sum, min and max."""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float):
+        """Estimate of the q-quantile, interpolated linearly inside its bucket as Prometheus does, within min and max."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                estimate = lower + (upper - lower) * (rank - cumulative) / count
+                return min(max(estimate, self.min), self.max)
+            cumulative += count
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Process-wide timings of the pipeline's stages.
+
+    Each timed operation has a name (browser_startup, search, inference, ...) and optional labels,
+    and every label combination keeps its own histogram of seconds and a count of failures. Timing
+    is a perf_counter pair and a locked bucket increment, so spans can stay on in production; with
+    `enabled` False they cost one attribute check.
+    """
+
+    def __init__(self, buckets=METRIC_BUCKETS, enabled: bool = METRICS_ENABLED):
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def error(self, name: str, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Time the enclosed block under `name`; an exception is also counted as an error of `name`."""
+        if not self.enabled:
+            yield
+            return
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(name, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator form of `span`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        """Every histogram as a dict, keyed by name and then by a `label=value,...` string ('' without labels)."""
+        with self._lock:
+            histograms = {key: histogram.as_dict() for key, histogram in self._histograms.items()}
+            errors = dict(self._errors)
+
+        snapshot = {}
+        for (name, labels), summary in sorted(histograms.items()):
+            label_text = ','.join(f'{label}={value}' for label, value in labels)
+            snapshot.setdefault(name, {})[label_text] = {**summary, "errors": errors.get((name, labels), 0)}
+        return snapshot
+
+    def to_json(self, extra: dict = None) -> str:
+        """The snapshot as JSON, optionally with other statistics (caches, pools) under `components`."""
+        report = {"timestamp": time.time(), "metrics": self.snapshot()}
+        if extra:
+            report["components"] = extra
+        return json.dumps(report, indent=2, default=str)
+
+    def to_prometheus(self, prefix: str = METRICS_PREFIX) -> str:
+        """The histograms and error counters in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {key: (list(histogram.counts), histogram.sum, histogram.count)
+                          for key, histogram in self._histograms.items()}
+            errors = dict(self._errors)
+
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{label}="{str(value)}"' for label, value in pairs) + '}'
+
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            family = f'{prefix}_{name}_seconds'
+            lines.append(f'# HELP {family} Duration of {name} in seconds')
+            lines.append(f'# TYPE {family} histogram')
+            for (key_name, labels), (counts, total, count) in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(self.buckets) + [math.inf], counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == math.inf else repr(float(bound))
+                    lines.append(f'{family}_bucket{label_text(labels, [("le", le)])} {cumulative}')
+                lines.append(f'{family}_sum{label_text(labels)} {total}')
+                lines.append(f'{family}_count{label_text(labels)} {count}')
+
+        for name in sorted({name for name, _ in errors}):
+            family = f'{prefix}_{name}_errors_total'
+            lines.append(f'# HELP {family} Failures of {name}')
+            lines.append(f'# TYPE {family} counter')
+            for (key_name, labels), count in sorted(errors.items()):
+                if key_name == name:
+                    lines.append(f'{family}{label_text(labels)} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory: str = METRICS_EXPORT_DIR, extra: dict = None):
+        """
+        Write metrics.json and metrics.prom to `directory`; the .prom file can be served by the
+        Prometheus node exporter's textfile collector. Files are replaced atomically, each from a
+        temporary file of its own, so concurrent writers never see each other's partial files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with self._write_lock:
+            for file_name, text in (('metrics.json', self.to_json(extra)), ('metrics.prom', self.to_prometheus())):
+                path = os.path.join(directory, file_name)
+                fd, tmp_path = tempfile.mkstemp(prefix=file_name + '.', suffix='.tmp', dir=directory)
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        f.write(text)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def span(name: str, **labels):
+    return _metrics.span(name, **labels)
+
+
+def timed(name: str, **labels):
+    return _metrics.timed(name, **labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    _metrics.observe(name, seconds, **labels)
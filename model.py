@@ -1,65 +1,94 @@
+import logging
 import numpy as np
 import cv2
 import os
-from ultralytics import YOLO
+import queue
+import threading
+import time
 import torch
+from concurrent.futures import Future
+from config import MODEL_WEIGHTS, BATCH_SIZE, MASK_THRESHOLD
+from mask_encoding import CompactMasks
+from metrics import timed
+from model_registry import predict
 
-def process_image(image_path: str, output_path: str = 'output.png', conf: float = 0.80, iou: float = 0.80) -> str:
+logger = logging.getLogger(__name__)
+
+def load_image(image) -> np.ndarray:
     """
-    Process an image using YOLO model for object detection and segmentation, and save the result with overlays.
-    
+    Load an image given either a file path or an already decoded BGR array.
+
     Parameters:
-        image_path (str): Path to the input image.
-        output_path (str): Path where the processed image will be saved.
-        conf (float): Confidence threshold for YOLO model.
-        iou (float): IOU threshold for YOLO model.
+        image (str | np.ndarray): Path to the image or a BGR image array.
 
     Returns:
-        str: Path to the saved output image.
+        np.ndarray: The image in BGR format.
     """
-    
-    # Initialize YOLO model
-    yolo_model = YOLO('rooftop_model.pt')
+    if isinstance(image, np.ndarray):
+        return image
 
-    # Load image using OpenCV
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"Image not found at the path: {image_path}")
+    loaded = cv2.imread(image)
+    if loaded is None:
+        raise ValueError(f"Image not found at the path: {image}")
+    return loaded
+
+# Red intensity of the mask layer by number of overlapping masks: one mask blends at half strength,
+# two or more saturate, as with repeated 0.5-weighted additions of a red layer.
+MASK_OVERLAP_LUT = np.minimum(np.arange(256) * 128, 255).astype(np.uint8)
+
+def blend_masks(image_rgb: np.ndarray, mask_data) -> np.ndarray:
+    """
+    Blend all segmentation masks onto an image in red in a single pass.
+
+    The masks are reduced to one overlap-count map, resized once to the image size and blended
+    once, so the cost no longer grows with one full-frame allocation and blend per rooftop.
+
+    Parameters:
+        image_rgb (np.ndarray): The image in RGB format.
+        mask_data: CompactMasks, or a tensor or array of masks with shape (C, H, W).
+
+    Returns:
+        np.ndarray: The blended image in RGB format.
+    """
+    if isinstance(mask_data, CompactMasks):
+        counts = mask_data.overlap_counts()
+    elif isinstance(mask_data, torch.Tensor):
+        counts = (mask_data > 0.5).sum(dim=0).clamp_(max=255).to(torch.uint8).cpu().numpy()
+    else:
+        counts = np.minimum((np.asarray(mask_data) > 0.5).sum(axis=0), 255).astype(np.uint8)
+
+    counts = cv2.resize(counts, (image_rgb.shape[1], image_rgb.shape[0]), interpolation=cv2.INTER_NEAREST)
+
+    mask_image = np.zeros_like(image_rgb)
+    mask_image[..., 0] = MASK_OVERLAP_LUT[counts]
+
+    return cv2.addWeighted(image_rgb, 1.0, mask_image, 0.5, 0)
+
+def draw_overlay(image: np.ndarray, result) -> np.ndarray:
+    """
+    Draw the segmentation masks, rooftop numbers and target point of one YOLO result onto an image.
+
+    Parameters:
+        image (np.ndarray): The BGR image the result was computed on.
+        result: A single YOLO result (one element of the list returned by the model), or its CompactMasks.
+
+    Returns:
+        np.ndarray: The annotated image in RGB format.
+    """
 
     # Convert the image from BGR (OpenCV format) to RGB (Matplotlib format)
     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-    # Run YOLO model on the image (with segmentation enabled)
-    results = yolo_model(image, conf=conf, iou=iou)
-
     # Get segmentation masks and bounding boxes (if available in the results)
-    masks = results[0].masks
-    boxes = results[0].boxes
-
-    # Create a copy of the original image for drawing
-    final_image = image_rgb.copy()
-
-    if masks:
-        mask_image = np.zeros_like(image_rgb)
-        
-        # Loop through each mask and apply it to the image
-        for idx, mask in enumerate(masks.data):
-            # Convert mask from float to 8-bit and resize to match the image dimensions
-            mask_resized = cv2.resize(mask.cpu().numpy().astype(np.uint8) * 255, (image_rgb.shape[1], image_rgb.shape[0]))
-            
-            # Colorize the mask (here, we use red)
-            mask_colored = np.zeros_like(image_rgb)
-            mask_colored[mask_resized == 255] = [255, 0, 0]  # Color the mask red
-            
-            # Overlay the colored mask onto the original image
-            mask_image = cv2.addWeighted(mask_image, 1.0, mask_colored, 0.5, 0)
-        
-        # Combine the original image with the mask image
-        final_image = cv2.addWeighted(image_rgb, 1.0, mask_image, 0.5, 0)
-    
+    masks = result if isinstance(result, CompactMasks) else CompactMasks.from_result(result)
+    boxes = [box for box in masks.boxes if box is not None] if masks else []
+
+    # Blend the masks, or start from a copy of the original image for drawing
+    final_image = blend_masks(image_rgb, masks) if masks else image_rgb.copy()
+
     # Draw bounding boxes and labels
     if boxes:
-        for i, box in enumerate(boxes.xyxy):  # Assuming `boxes.xyxy` contains bounding box coordinates
+        for i, box in enumerate(boxes):  # Bounding boxes as [x1, y1, x2, y2]
             x1, y1, x2, y2 = map(int, box)
             # cv2.rectangle(final_image, (x1, y1), (x2, y2), (0, 255, 0), 2)  # Draw bounding box in green
             
@@ -75,97 +104,226 @@ def process_image(image_path: str, output_path: str = 'output.png', conf: float
             cv2.putText(final_image, str(i + 1), (centroid_x, centroid_y), 
                         cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
     
-    # Save the image with segmentation masks and labels
+    # Mark the target point
     center_x = 269
     center_y = 235
     radius = 5
     color = (0, 0, 0)
     thickness = -1
     cv2.circle(final_image, (center_x, center_y), radius, color, thickness)
-    cv2.imwrite(output_path, cv2.cvtColor(final_image, cv2.COLOR_RGB2BGR))
+
+    return final_image
+
+def process_image(image_path: str, output_path: str = 'output.png', conf: float = 0.80, iou: float = 0.80, weights: str = MODEL_WEIGHTS, render: bool = True) -> str:
+    """
+    Process an image using YOLO model for object detection and segmentation, and save the result with overlays.
+    
+    Parameters:
+        image_path (str): Path to the input image.
+        output_path (str): Path where the processed image will be saved.
+        conf (float): Confidence threshold for YOLO model.
+        iou (float): IOU threshold for YOLO model.
+        weights (str): Weights file of the model, served warm from the model registry.
+        render (bool): Draw and save the overlay. Set to False when only the mask analysis is needed.
+
+    Returns:
+        str: Path to the saved output image.
+    """
+
+    # Load image using OpenCV
+    image = load_image(image_path)
+
+    # Run YOLO model on the image (with segmentation enabled)
+    results = predict(image, weights, conf=conf, iou=iou)
+
+    # Save the image with segmentation masks and labels
+    if render:
+        final_image = draw_overlay(image, results[0])
+        cv2.imwrite(output_path, cv2.cvtColor(final_image, cv2.COLOR_RGB2BGR))
     
     return results
 
-def analyze_masks(results, total_area: float, center_x: int = 270, center_y: int = 235, size_of_point: int = 20, mask_threshold: float = 0.5):
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def process_images_batch(images, output_paths=None, batch_size: int = BATCH_SIZE, total_area: float = 36000,
+                         conf: float = 0.80, iou: float = 0.80, weights: str = MODEL_WEIGHTS, render: bool = True):
+    """
+    Segment many images, running them through the model `batch_size` images per forward pass.
+
+    Images are read lazily from the input, so an iterator over a large folder is never held in memory at once.
+    Each result's masks are run-length encoded straight after inference and the dense mask tensor is
+    released, so a batch in flight holds a few KB of masks per image rather than a float per pixel.
+
+    Parameters:
+        images (Iterable[str | np.ndarray]): Image paths or BGR image arrays.
+        output_paths (Iterable[str] | None): Optional paths, one per image, where the overlays are saved.
+        batch_size (int): Number of images per forward pass.
+        total_area (float): Total area of the region, passed to `analyze_masks`.
+        conf (float): Confidence threshold for YOLO model.
+        iou (float): IOU threshold for YOLO model.
+        weights (str): Weights file of the model, served warm from the model registry.
+        render (bool): Draw (and save) the overlays. When False, `overlay` is None.
+
+    Yields:
+        dict: Per image, in input order: the `source` (path, or index for arrays), the YOLO `result`
+        (boxes and metadata; its `masks` released), the `masks` as CompactMasks (None if no rooftop was
+        found), the `mask_analysis` dictionary (empty if no rooftop was found) and the RGB `overlay` image.
+    """
+    output_iter = iter(output_paths) if output_paths is not None else None
+    index = 0
+
+    for chunk in _chunks(images, batch_size):
+        arrays = [load_image(image) for image in chunk]
+        results = predict(arrays, weights, conf=conf, iou=iou)
+
+        for image, array, result in zip(chunk, arrays, results):
+            masks = CompactMasks.from_result(result)
+            result.masks = None
+            mask_analysis = analyze_masks(masks, total_area) if masks is not None else {}
+
+            overlay = None
+            output_path = next(output_iter) if output_iter is not None else None
+            if render:
+                overlay = draw_overlay(array, masks if masks is not None else result)
+                if output_path is not None:
+                    cv2.imwrite(output_path, cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+
+            yield {
+                "source": image if isinstance(image, str) else index,
+                "result": result,
+                "masks": masks,
+                "mask_analysis": mask_analysis,
+                "overlay": overlay,
+            }
+            index += 1
+
+class InferenceBatcher:
+    """
+    Collects images submitted from many threads and segments them together in batches.
+
+    Each `submit` returns a Future for that image's `process_images_batch` item. A batch is run as
+    soon as `batch_size` images are waiting, or `max_wait` seconds after the first of them arrived,
+    on `workers` background threads.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, max_wait: float = 0.05, workers: int = 1,
+                 total_area: float = 36000, render: bool = False, **predict_kwargs):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.total_area = total_area
+        self.render = render
+        self.predict_kwargs = predict_kwargs
+        self.batches = 0
+        self.images = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._work, name=f'inference-{i}', daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, image, output_path: str = None) -> Future:
+        future = Future()
+        self._queue.put((image, output_path, future))
+        return future
+
+    def _work(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(pending) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            images, output_paths, futures = zip(*pending)
+            try:
+                processed = list(process_images_batch(images, output_paths, batch_size=len(images), total_area=self.total_area,
+                                                      render=self.render, **self.predict_kwargs))
+                for future, item in zip(futures, processed):
+                    future.set_result(item)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            with self._lock:
+                self.batches += 1
+                self.images += len(images)
+
+    def stats(self) -> dict:
+        """Batches run and images segmented so far, read together under the lock."""
+        with self._lock:
+            return {"batches": self.batches, "images": self.images,
+                    "mean_batch_size": self.images / self.batches if self.batches else 0.0}
+
+@timed('mask_analysis')
+def analyze_masks(results, total_area: float, center_x: int = 270, center_y: int = 235, size_of_point: int = 20,
+                  mask_threshold: float = MASK_THRESHOLD, points: list = None):
     """
     Analyze segmentation masks, calculate percentage areas, and determine masks within a given ROI.
 
+    Areas and ROI hits are computed on the run-length encoded masks; YOLO results are encoded first.
+
     Parameters:
-        results: The result object from YOLO model containing masks and bounding boxes.
+        results: The result object from YOLO model containing masks and bounding boxes, or CompactMasks.
         total_area (float): Total area of the region for calculating the actual rooftop areas.
         center_x (int): X-coordinate of the center point for ROI.
         center_y (int): Y-coordinate of the center point for ROI.
         size_of_point (int): Size of the ROI for selecting rooftops. Increased default size for larger region check.
-        mask_threshold (float): Threshold to binarize masks. Default is 0.5.
+        mask_threshold (float): Threshold to binarize masks. Default is 0.5. CompactMasks are already binary.
+        points (list[tuple[int, int]] | None): Extra (x, y) query points, e.g. several candidate addresses
+            on the same tile. Their matches are returned under "point_masks" in the same order.
     
     Returns:
         dict: A dictionary containing all mask areas and the mask within the defined ROI.
     """
     
     # Extract masks from YOLO results
-    masks = results[0].masks
+    masks = results if isinstance(results, CompactMasks) else CompactMasks.from_result(results[0], mask_threshold)
     if masks is None:
         raise ValueError("No masks found in the results.")
 
-    mask_data = masks.data  # Assuming masks.data is a tensor or numpy array (C, H, W)
-    
     # Get total pixels for percentage calculation
-    total_pixels = mask_data.shape[1] * mask_data.shape[2]
-    print(f"Total Pixels: {total_pixels}")
-    
-    # Calculate the area of each mask and percentage relative to the total image
-    mask_dict = {}
-    mask_areas = [mask.sum().item() for mask in mask_data]
-    mask_percentages = [(area / total_pixels) * 100 for area in mask_areas]
-
-    # Output all rooftop areas
-    print("######################################################################################")
-    print("All rooftops")
-    for i, (percentage, area) in enumerate(zip(mask_percentages, mask_areas)):
-        mask_number = i + 1
-        pixel_area = area
-        percent_area = round(percentage, 2)
-        actual_area = round(((percentage * total_area) / 100), 2)
-        mask_dict[mask_number] = actual_area
-
-        print(f"Mask: {mask_number}, Pixel Area: {pixel_area}, Percent Area: {percent_area:.2f}%, Actual Area: {actual_area}")
-    
+    total_pixels = masks.size[0] * masks.size[1]
+
+    # Area of every mask from its run lengths
+    mask_areas = masks.areas()
+    actual_areas = [round(((area / total_pixels) * total_area), 2) for area in mask_areas]
+    mask_dict = {i + 1: actual_area for i, actual_area in enumerate(actual_areas)}
+
     # Dictionary to store all data
     mask_analysis = {"all_mask_area": mask_dict}
 
-    # Now check if the point (center_x, center_y) falls within any mask, considering the size_of_point
-    roi_mask_found = False
-    print("######################################################################################")
-    print(f"Checking if region around point ({center_x}, {center_y}) falls within any mask...")
+    # Check which mask, if any, lies around the target point and each extra query point
+    query_points = [(center_x, center_y)] + list(points or [])
+    hits = masks.masks_at_points(query_points, size_of_point)
 
-    for i, mask in enumerate(mask_data):
-        # Apply a threshold to the mask to ensure it's binary
-        mask_bool = mask > mask_threshold
+    target_hit = hits[0]
+    mask_analysis["target_mask"] = {target_hit + 1: actual_areas[target_hit]} if target_hit is not None else None
 
-        # Define a larger region to increase chances of detection
-        x_min = max(0, center_x - size_of_point)
-        x_max = min(mask_data.shape[2], center_x + size_of_point + 1)
-        y_min = max(0, center_y - size_of_point)
-        y_max = min(mask_data.shape[1], center_y + size_of_point + 1)
+    if points is not None:
+        mask_analysis["point_masks"] = [
+            {"point": [x, y], "mask": {hit + 1: actual_areas[hit]} if hit is not None else None}
+            for (x, y), hit in zip(points, hits[1:])
+        ]
 
-        # Convert mask to boolean and check if any value is inside the mask
-        region_bool = mask_bool[y_min:y_max, x_min:x_max]
-        print(f"Checking mask {i+1}: Region {region_bool.shape} with bounds x:({x_min},{x_max}), y:({y_min},{y_max})")
-
-        if region_bool.sum().item() > 0:
-            print(f"Region around point ({center_x}, {center_y}) falls within mask {i+1}.")
-            roi_mask_found = True
-            
-            # Update mask_analysis with target mask info
-            percent_area = mask_percentages[i]
-            actual_area = round(((percent_area * total_area) / 100), 2)
-            mask_analysis["target_mask"] = {i + 1: actual_area}
-            break
-    
-    if not roi_mask_found:
-        print(f"Region around point ({center_x}, {center_y}) does not fall within any mask.")
-        mask_analysis["target_mask"] = None
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Mask analysis", extra={"mask_analysis": {
+            "total_pixels": total_pixels,
+            "pixel_areas": mask_areas,
+            "actual_areas": actual_areas,
+            "query_points": query_points,
+            "hits": hits,
+        }})
     
     return mask_analysis
-
-
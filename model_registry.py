@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+import numpy as np
+from ultralytics import YOLO
+from backends import export_model
+from metrics import observe
+from config import MODEL_WEIGHTS, WARMUP_IMAGE_SIZE, INFERENCE_BACKEND, INFERENCE_INT8
+
+logger = logging.getLogger(__name__)
+
+
+class LoadedModel:
+    """A YOLO model held in memory together with its lock and timing statistics."""
+
+    def __init__(self, weights_path: str, backend: str = 'torch', int8: bool = False):
+        self.weights_path = weights_path
+        self.backend = backend
+        self.int8 = int8
+        self.lock = threading.Lock()
+
+        # Exported models do not record their task. Every backend returns its masks at the input image
+        # size, so analyze_masks sees the same geometry (areas, ROI point) whatever the backend's letterbox size
+        model_path = export_model(weights_path, backend, int8)
+        self.predict_defaults = {'retina_masks': True}
+
+        start_time = time.perf_counter()
+        self.model = YOLO(model_path, task='segment')
+        self.load_time = time.perf_counter() - start_time
+
+        self.warmup_time = None
+        self.inference_count = 0
+        self.inference_total = 0.0
+        self.inference_min = None
+        self.inference_max = None
+        self.inference_last = None
+
+    def warm_up(self, size: tuple = WARMUP_IMAGE_SIZE):
+        """Run one dummy forward pass so graph building and allocations happen before real traffic."""
+        height, width = size
+        dummy_image = np.zeros((height, width, 3), dtype=np.uint8)
+        start_time = time.perf_counter()
+        with self.lock:
+            self.model(dummy_image, verbose=False, **self.predict_defaults)
+        self.warmup_time = time.perf_counter() - start_time
+
+    def predict(self, source, **kwargs):
+        """Run inference under the model lock and record the call latency."""
+        kwargs.setdefault('verbose', False)
+        for key, value in self.predict_defaults.items():
+            kwargs.setdefault(key, value)
+        with self.lock:
+            start_time = time.perf_counter()
+            results = self.model(source, **kwargs)
+            elapsed = time.perf_counter() - start_time
+            observe('inference', elapsed, backend=self.backend + ('_int8' if self.int8 else ''))
+
+            self.inference_count += 1
+            self.inference_total += elapsed
+            self.inference_last = elapsed
+            self.inference_min = elapsed if self.inference_min is None else min(self.inference_min, elapsed)
+            self.inference_max = elapsed if self.inference_max is None else max(self.inference_max, elapsed)
+
+        return results
+
+    def stats(self) -> dict:
+        mean = self.inference_total / self.inference_count if self.inference_count else None
+        return {
+            "weights": self.weights_path,
+            "backend": self.backend + (' int8' if self.int8 else ''),
+            "load_time": self.load_time,
+            "warmup_time": self.warmup_time,
+            "inference_count": self.inference_count,
+            "inference_mean": mean,
+            "inference_min": self.inference_min,
+            "inference_max": self.inference_max,
+            "inference_last": self.inference_last,
+        }
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of YOLO models keyed on their weights file and inference backend.
+
+    Each weights file is loaded (exported first for non-torch backends) and warmed up exactly
+    once per backend; later calls reuse the in-memory model. Predictions on the same model are
+    serialised with a lock because the ultralytics predictor keeps per-call state on the model object.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, weights_path: str = MODEL_WEIGHTS, warm_up: bool = True, backend: str = None,
+            int8: bool = None) -> LoadedModel:
+        backend = backend or INFERENCE_BACKEND
+        # int8 quantisation only applies to exported models
+        int8 = (INFERENCE_INT8 if int8 is None else int8) and backend != 'torch'
+        key = (weights_path, backend, int8)
+        loaded = self._models.get(key)
+        if loaded is not None:
+            return loaded
+
+        with self._lock:
+            loaded = self._models.get(key)
+            if loaded is None:
+                loaded = LoadedModel(weights_path, backend, int8)
+                if warm_up:
+                    loaded.warm_up()
+                self._models[key] = loaded
+                logger.info(f"Loaded model {weights_path} ({backend}{' int8' if int8 else ''}) in {loaded.load_time:.2f} seconds"
+                      + (f", warm-up {loaded.warmup_time:.2f} seconds" if warm_up else ""))
+        return loaded
+
+    def predict(self, source, weights_path: str = MODEL_WEIGHTS, backend: str = None, int8: bool = None, **kwargs):
+        return self.get(weights_path, backend=backend, int8=int8).predict(source, **kwargs)
+
+    def stats(self) -> dict:
+        return {f"{weights_path}:{backend}{':int8' if int8 else ''}": loaded.stats()
+                for (weights_path, backend, int8), loaded in self._models.items()}
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    return _registry
+
+
+def warm_up(weights_path: str = MODEL_WEIGHTS, backend: str = None, int8: bool = None) -> dict:
+    """Load and warm up a model at startup. Returns its timing statistics."""
+    return _registry.get(weights_path, backend=backend, int8=int8).stats()
+
+
+def predict(source, weights_path: str = MODEL_WEIGHTS, backend: str = None, int8: bool = None, **kwargs):
+    return _registry.predict(source, weights_path, backend, int8, **kwargs)
+
+
+def model_stats() -> dict:
+    return _registry.stats()
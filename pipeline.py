@@ -0,0 +1,168 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import PIPELINE_WORKERS
+from mask_encoding import CompactMasks
+from metrics import observe, get_metrics
+
+
+class StageGraph:
+    """
+    A small DAG of pipeline stages for one request.
+
+    Each stage is a function called with the outputs of its dependencies, in the order they were
+    declared. `run` executes every stage exactly once, starting a stage as soon as all of its
+    dependencies have finished, so independent branches overlap on the worker threads. Outputs
+    are memoised in `outputs` and every execution is recorded in `trace`.
+    """
+
+    def __init__(self, max_workers: int = PIPELINE_WORKERS, progress=None):
+        """
+        Parameters:
+            max_workers (int): Threads running stages concurrently.
+            progress: Optional callback, called as progress(stage_name, ok) after each stage finishes.
+        """
+        self.max_workers = max_workers
+        self.progress = progress
+        self.stages = {}
+        self.outputs = {}
+        self.errors = {}
+        self.trace = []
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    def add(self, name: str, func, deps=()):
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already defined")
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = (func, tuple(deps))
+        return self
+
+    def _run_stage(self, name: str):
+        func, deps = self.stages[name]
+        start_time = time.perf_counter()
+        error = None
+        try:
+            output = func(*(self.outputs[dep] for dep in deps))
+        except Exception as e:
+            error = e
+        end_time = time.perf_counter()
+        observe('pipeline_stage', end_time - start_time, stage=name)
+        if error is not None:
+            get_metrics().error('pipeline_stage', stage=name)
+
+        with self._lock:
+            if error is None:
+                self.outputs[name] = output
+            else:
+                self.errors[name] = error
+            self.trace.append({
+                "stage": name,
+                "start": start_time - self._started_at,
+                "seconds": end_time - start_time,
+                "thread": threading.current_thread().name,
+                "ok": error is None,
+            })
+
+        if self.progress is not None:
+            self.progress(name, error is None)
+
+    def run(self) -> dict:
+        """
+        Run every stage not yet run. Stages whose dependencies failed are skipped and recorded as such.
+
+        Returns:
+            dict: Stage outputs by stage name.
+        """
+        self._started_at = self._started_at or time.perf_counter()
+        pending = {name for name in self.stages if name not in self.outputs and name not in self.errors}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='stage') as executor:
+            while pending or running:
+                for name in sorted(pending):
+                    deps = self.stages[name][1]
+                    if any(dep in self.errors for dep in deps):
+                        pending.discard(name)
+                        with self._lock:
+                            self.errors[name] = RuntimeError(f"Skipped: a dependency of {name} failed")
+                            self.trace.append({"stage": name, "start": None, "seconds": 0.0, "thread": None, "ok": False})
+                    elif all(dep in self.outputs for dep in deps):
+                        pending.discard(name)
+                        running[executor.submit(self._run_stage, name)] = name
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    future.result()
+
+        return self.outputs
+
+    def timings(self) -> dict:
+        """Seconds spent in each stage, plus the wall time of the whole run."""
+        timings = {entry["stage"]: entry["seconds"] for entry in self.trace}
+        finished = [entry["start"] + entry["seconds"] for entry in self.trace if entry["start"] is not None]
+        timings["total"] = max(finished) if finished else 0.0
+        return timings
+
+
+class PipelineResult:
+    """Everything one request produces, as returned by GoogleEarthAutomation.process."""
+
+    def __init__(self, place_name, image=None, scale="NA", location="NA", latitude="NA", longitude="NA",
+                 average_irradiance="NA", total_irradiance="NA", mask_analysis=None,
+                 coordinate_source=None, trace=None, errors=None, masks=None):
+        self.place_name = place_name
+        self.image = image
+        self.scale = scale
+        self.location = location
+        self.latitude = latitude
+        self.longitude = longitude
+        self.average_irradiance = average_irradiance
+        self.total_irradiance = total_irradiance
+        self.mask_analysis = mask_analysis if mask_analysis is not None else {}
+        # Run-length encoded rooftop masks the analysis was computed on (CompactMasks), if any
+        self.masks = masks
+        self.coordinate_source = coordinate_source
+        self.trace = trace or []
+        self.errors = errors or {}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Rebuild a result from `as_dict` output. Errors come back as their messages."""
+        return cls(
+            data["place_name"],
+            scale=data.get("scale", "NA"),
+            location=data.get("location", "NA"),
+            latitude=data.get("latitude", "NA"),
+            longitude=data.get("longitude", "NA"),
+            average_irradiance=data.get("average_irradiance", "NA"),
+            total_irradiance=data.get("total_irradiance", "NA"),
+            mask_analysis=data.get("mask_analysis"),
+            coordinate_source=data.get("coordinate_source"),
+            trace=data.get("trace"),
+            errors=data.get("errors"),
+            masks=CompactMasks.from_dict(data["masks"]) if data.get("masks") else None,
+        )
+
+    def as_dict(self) -> dict:
+        """The JSON-serialisable part of the result (everything except the image)."""
+        return {
+            "place_name": self.place_name,
+            "scale": self.scale,
+            "location": self.location,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "average_irradiance": self.average_irradiance,
+            "total_irradiance": self.total_irradiance,
+            "mask_analysis": self.mask_analysis,
+            "masks": self.masks.to_dict() if self.masks is not None else None,
+            "coordinate_source": self.coordinate_source,
+            "trace": self.trace,
+            "errors": {stage: str(error) for stage, error in self.errors.items()},
+        }
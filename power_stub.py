@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from irradiance_cache import IrradianceCache
+from solar_api import fetch_solar_irradiance, aggregate_irradiance
+
+
+def power_response(days: int = 365) -> dict:
+    """A fixed NASA POWER daily ALLSKY_SFC_SW_DWN response: a repeating weekly pattern with one missing (-999) day a month."""
+    values = {}
+    for day in range(days):
+        values[f"day{day:03d}"] = -999.0 if day % 30 == 29 else round(2.0 + (day % 7) * 0.75, 2)
+    return {"properties": {"parameter": {"ALLSKY_SFC_SW_DWN": values}}}
+
+
+class PowerStubServer:
+    """
+    Local HTTP server standing in for the NASA POWER daily point API, for offline runs of the irradiance cache.
+
+    Every GET is answered with the same `response` JSON and its query string is kept in `requests`,
+    so callers can count how often the real API would have been hit. Point POWER_API_URL, or the
+    `base_url` of fetch_solar_irradiance, at `url`.
+    """
+
+    def __init__(self, response: dict = None, host: str = '127.0.0.1', port: int = 0):
+        self.response = response if response is not None else power_response()
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append({key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()})
+                body = json.dumps(stub.response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self._server.server_address[1]}/api/temporal/daily/point"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def check_cache(stub: PowerStubServer, directory: str) -> list:
+    """
+    Exercise the irradiance cache against the stub: a miss, a hit, TTL expiry and LRU eviction.
+
+    Each check compares the stub's request count (one per miss) and the cache's hit and miss
+    counters with what the cache should have done.
+
+    Returns:
+        list[tuple[str, bool, str]]: One (check, passed, detail) row per check.
+    """
+    expected = aggregate_irradiance(stub.response)
+    rows = []
+
+    def fetch(cache, latitude, longitude):
+        before = len(stub.requests)
+        value = fetch_solar_irradiance(latitude, longitude, base_url=stub.url, cache=cache)
+        return value, len(stub.requests) - before
+
+    def check(name, passed, detail):
+        rows.append((name, bool(passed), detail))
+
+    # Miss, then hit on a nearby point in the same grid cell
+    cache = IrradianceCache(os.path.join(directory, 'hits.sqlite'))
+    value, calls = fetch(cache, 57.1645, -2.1012)
+    check('miss', calls == 1 and value == expected and cache.misses == 1, f"{calls} request(s), {value}")
+    value, calls = fetch(cache, 57.1646, -2.1013)
+    check('hit', calls == 0 and value == expected and cache.hits == 1, f"{calls} request(s), {value}")
+
+    # An entry older than the TTL is fetched again
+    ttl = 0.5
+    cache = IrradianceCache(os.path.join(directory, 'ttl.sqlite'), ttl=ttl)
+    fetch(cache, 57.1645, -2.1012)
+    time.sleep(ttl * 1.5)
+    _, calls = fetch(cache, 57.1645, -2.1012)
+    check('ttl_expiry', calls == 1, f"{calls} request(s) after {ttl * 1.5:.2f} seconds")
+
+    # With room for two cells, adding a third evicts the least recently used one
+    cache = IrradianceCache(os.path.join(directory, 'lru.sqlite'), max_entries=2)
+    first, second, third = (51.5007, -0.1246), (48.8584, 2.2945), (40.6892, -74.0445)
+    for point in (first, second):
+        fetch(cache, *point)
+        time.sleep(0.01)
+    fetch(cache, *first)  # First becomes the most recently used
+    time.sleep(0.01)
+    fetch(cache, *third)
+    _, first_calls = fetch(cache, *first)
+    _, second_calls = fetch(cache, *second)
+    check('lru_eviction', first_calls == 0 and second_calls == 1,
+          f"recently used cell {first_calls} request(s), least recently used cell {second_calls} request(s)")
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the NASA POWER API, and an offline check of the irradiance cache against it.")
+    parser.add_argument('--serve', action='store_true', help="Only serve the stub until interrupted, e.g. for POWER_API_URL")
+    parser.add_argument('--port', type=int, default=0, help="Port to serve on; by default a free one")
+    args = parser.parse_args()
+
+    with PowerStubServer(port=args.port) as stub:
+        if args.serve:
+            print(f"Serving a NASA POWER stub at {stub.url}")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                return
+
+        with tempfile.TemporaryDirectory() as directory:
+            rows = check_cache(stub, directory)
+
+    for name, passed, detail in rows:
+        print(f"{'ok' if passed else 'FAILED':>6}  {name:<14} {detail}")
+    if not all(passed for _, passed, _ in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
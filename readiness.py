@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from metrics import observe
+from config import READINESS_TIMEOUTS, STABLE_VIEW_INTERVAL, STABLE_VIEW_THRESHOLD, STABLE_VIEW_FRAMES, WAIT_HISTORY_SIZE
+
+
+class WaitRecorder:
+    """
+    Collects how long each readiness wait actually took, per stage, so timeouts can be tuned from data.
+
+    Counts of waits and timeouts cover the whole run; the duration statistics cover the most recent
+    `history_size` waits of each stage.
+    """
+
+    def __init__(self, history_size: int = WAIT_HISTORY_SIZE):
+        self.history_size = history_size
+        self._waits = {}
+        self._counts = {}
+        self._timeouts = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, ready: bool):
+        observe('readiness_wait', seconds, stage=stage)
+        with self._lock:
+            waits = self._waits.get(stage)
+            if waits is None:
+                waits = self._waits[stage] = deque(maxlen=self.history_size)
+            waits.append(seconds)
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+            if not ready:
+                self._timeouts[stage] = self._timeouts.get(stage, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = {stage: list(values) for stage, values in self._waits.items()}
+            counts = dict(self._counts)
+            timeouts = dict(self._timeouts)
+
+        summary = {}
+        for stage, values in waits.items():
+            durations = sorted(values)
+            summary[stage] = {
+                "count": counts[stage],
+                "timeouts": timeouts.get(stage, 0),
+                "mean": sum(durations) / len(durations),
+                "p50": durations[len(durations) // 2],
+                "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                "max": durations[-1],
+                "timeout": READINESS_TIMEOUTS.get(stage),
+            }
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self._waits.clear()
+            self._counts.clear()
+            self._timeouts.clear()
+
+
+_recorder = WaitRecorder()
+
+
+def wait_stats() -> dict:
+    return _recorder.stats()
+
+
+def _timeout(stage: str, timeout: float = None) -> float:
+    return timeout if timeout is not None else READINESS_TIMEOUTS[stage]
+
+
+def wait_for_document_ready(driver, stage: str = 'page_load', timeout: float = None) -> bool:
+    """Wait until the page reports document.readyState == 'complete'."""
+    start_time = time.perf_counter()
+    try:
+        WebDriverWait(driver, _timeout(stage, timeout)).until(
+            lambda d: d.execute_script("return document.readyState") == 'complete')
+        ready = True
+    except TimeoutException:
+        ready = False
+    _recorder.record(stage, time.perf_counter() - start_time, ready)
+    return ready
+
+
+def wait_for_element(driver, locator, stage: str, timeout: float = None):
+    """Wait until the element at `locator` (a (By, value) tuple) is present. Returns it, or None on timeout."""
+    start_time = time.perf_counter()
+    try:
+        element = WebDriverWait(driver, _timeout(stage, timeout)).until(EC.presence_of_element_located(locator))
+    except TimeoutException:
+        element = None
+    _recorder.record(stage, time.perf_counter() - start_time, element is not None)
+    return element
+
+
+# The focused element, followed into shadow roots (Earth is built from web components), if it is an
+# enabled, rendered text input
+FOCUSED_INPUT_SCRIPT = """
+let element = document.activeElement;
+while (element && element.shadowRoot && element.shadowRoot.activeElement) {
+    element = element.shadowRoot.activeElement;
+}
+if (element && element.tagName === 'INPUT' && !element.disabled && element.getClientRects().length) {
+    return element;
+}
+return null;
+"""
+
+
+def focused_input(driver):
+    """The focused text input of the page, or None."""
+    return driver.execute_script(FOCUSED_INPUT_SCRIPT)
+
+
+def wait_for_focused_input(driver, stage: str, timeout: float = None):
+    """Wait until a rendered, enabled text input has the focus. Returns it, or None on timeout."""
+    start_time = time.perf_counter()
+    try:
+        element = WebDriverWait(driver, _timeout(stage, timeout)).until(lambda d: focused_input(d))
+    except TimeoutException:
+        element = None
+    _recorder.record(stage, time.perf_counter() - start_time, element is not None)
+    return element
+
+
+def grab_frame(driver, scale: float = 0.25) -> np.ndarray:
+    """A small grayscale copy of the current viewport, for cheap frame differencing."""
+    png = driver.get_screenshot_as_png()
+    frame = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE)
+    return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def wait_for_stable_view(driver, stage: str, timeout: float = None, require_change: bool = False,
+                         interval: float = STABLE_VIEW_INTERVAL, threshold: float = STABLE_VIEW_THRESHOLD,
+                         stable_frames: int = None) -> bool:
+    """
+    Wait until the rendered view stops changing.
+
+    Successive viewport grabs are compared by mean absolute pixel difference; the view has settled once
+    `stable_frames` (by default the stage's STABLE_VIEW_FRAMES) consecutive differences fall below
+    `threshold`. With `require_change`, the view must first change at all, so a wait started just
+    before a fly-to animation does not return at once.
+
+    Returns:
+        bool: True if the view settled, False if `timeout` seconds passed first.
+    """
+    timeout = _timeout(stage, timeout)
+    stable_frames = stable_frames or STABLE_VIEW_FRAMES.get(stage, STABLE_VIEW_FRAMES['default'])
+    start_time = time.perf_counter()
+    previous = grab_frame(driver)
+    changed = not require_change
+    stable = 0
+    ready = False
+
+    while time.perf_counter() - start_time < timeout:
+        time.sleep(interval)
+        frame = grab_frame(driver)
+        difference = float(cv2.absdiff(frame, previous).mean())
+        previous = frame
+
+        if difference >= threshold:
+            changed = True
+            stable = 0
+        elif changed:
+            stable += 1
+            if stable >= stable_frames:
+                ready = True
+                break
+
+    _recorder.record(stage, time.perf_counter() - start_time, ready)
+    return ready
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from config import REPLAY_ARCHIVE_DIR, REPLAY_LATENCY_SCALE
+from jobs import normalize_place_name
+
+EVENTS_NAME = 'events.json'
+
+
+class ReplayError(Exception):
+    """Raised when a replayed place has no recording, or no recorded call left for a step."""
+
+
+class ReplayedCallError(Exception):
+    """A call that failed while recording, failing the same way on replay."""
+
+
+def archive_path(place_name: str, directory: str = REPLAY_ARCHIVE_DIR) -> str:
+    """The archive of a place: its normalised name made file-safe, plus a short hash to keep names distinct."""
+    key = normalize_place_name(place_name)
+    slug = re.sub(r'[^a-z0-9]+', '_', key).strip('_')[:60]
+    return os.path.join(directory, f"{slug}_{hashlib.sha1(key.encode()).hexdigest()[:8]}.zip")
+
+
+class Recorder:
+    """
+    Records the slow, external calls of one place: browser steps, screenshots and HTTP responses.
+
+    `call(name, func)` runs `func` and keeps its return value and duration in order. Bytes (screenshot
+    PNGs) are stored as files of their own, uncompressed as PNGs already are; everything else goes
+    into one compressed events.json. `save` writes the place's zip archive.
+    """
+
+    mode = 'record'
+
+    def __init__(self, place_name: str, directory: str = REPLAY_ARCHIVE_DIR):
+        self.place_name = place_name
+        self.path = archive_path(place_name, directory)
+        self.events = []
+        self.blobs = {}
+        self._lock = threading.Lock()
+
+    def call(self, name: str, func):
+        start_time = time.perf_counter()
+        error = None
+        try:
+            value = func()
+        except Exception as e:
+            error = e
+        seconds = time.perf_counter() - start_time
+
+        with self._lock:
+            event = {"name": name, "seconds": seconds}
+            if error is not None:
+                event["error"] = str(error)
+            elif isinstance(value, bytes):
+                event["file"] = f"{len(self.events):03d}_{re.sub(r'[^a-z0-9]+', '_', name.lower())}.png"
+                self.blobs[event["file"]] = value
+            else:
+                event["value"] = value
+            self.events.append(event)
+
+        if error is not None:
+            raise error
+        return value
+
+    def save(self) -> str:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with zipfile.ZipFile(tmp_path, 'w') as archive:
+            archive.writestr(EVENTS_NAME, json.dumps({"place_name": self.place_name, "recorded_at": time.time(),
+                                                      "events": self.events}, default=str),
+                             compress_type=zipfile.ZIP_DEFLATED)
+            for file_name, data in self.blobs.items():
+                archive.writestr(file_name, data, compress_type=zipfile.ZIP_STORED)
+        os.replace(tmp_path, self.path)
+        return self.path
+
+
+class Replayer:
+    """
+    Plays back a place recorded by Recorder.
+
+    `call(name, func)` does not run `func`: it returns the next value recorded under `name`, or
+    raises again if that call failed, after sleeping the recorded duration times `latency_scale`.
+    A scale of 1 reproduces the recorded timing, 0 runs at full speed.
+    """
+
+    mode = 'replay'
+
+    def __init__(self, place_name: str, directory: str = REPLAY_ARCHIVE_DIR, latency_scale: float = REPLAY_LATENCY_SCALE):
+        self.place_name = place_name
+        self.path = archive_path(place_name, directory)
+        self.latency_scale = latency_scale
+        if not os.path.exists(self.path):
+            raise ReplayError(f"No recording of {place_name} at {self.path}")
+
+        self._archive = zipfile.ZipFile(self.path)
+        recording = json.loads(self._archive.read(EVENTS_NAME))
+        self.recorded_at = recording["recorded_at"]
+        self._queues = {}
+        for event in recording["events"]:
+            self._queues.setdefault(event["name"], []).append(event)
+        self._lock = threading.Lock()
+
+    def recorded(self, name: str) -> bool:
+        return bool(self._queues.get(name))
+
+    def call(self, name: str, func=None):
+        with self._lock:
+            queue = self._queues.get(name)
+            if not queue:
+                raise ReplayError(f"No recorded {name} left for {self.place_name}")
+            event = queue.pop(0)
+            value = self._archive.read(event["file"]) if "file" in event else event.get("value")
+
+        if self.latency_scale:
+            time.sleep(event["seconds"] * self.latency_scale)
+        if "error" in event:
+            raise ReplayedCallError(event["error"])
+        return value
+
+    def close(self):
+        self._archive.close()
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import cv2
+import numpy as np
+from config import RESULT_CACHE_DIR, RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES
+from jobs import normalize_place_name
+from pipeline import PipelineResult
+
+
+# Per-run details left out of a result's content hash
+CONTENT_EXCLUDED_FIELDS = ('place_name', 'trace', 'errors')
+
+
+def place_key(place_name: str) -> str:
+    return 'place:' + normalize_place_name(place_name)
+
+
+def coordinate_key(latitude: float, longitude: float) -> str:
+    return f'coord:{round(float(latitude), 4)},{round(float(longitude), 4)}'
+
+
+class ResultCache:
+    """
+    Persistent cache of whole-pipeline results.
+
+    Results are stored once, under the hash of their analysis and overlay (not of per-run details such as
+    the stage trace), and can be found under several keys: the normalised place name and, when they were
+    resolved, the rounded coordinates. Storing a place again replaces its previous result. Overlay images
+    are kept as PNG files named by their hash next to the SQLite index. Entries expire after `ttl`
+    seconds, and beyond `max_entries` results or `max_bytes` of images the least recently used are
+    evicted.
+    """
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR, ttl: float = RESULT_CACHE_TTL,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(directory, 'results.sqlite'), check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " id TEXT PRIMARY KEY, result TEXT, image TEXT, size INTEGER, created_at REAL, accessed_at REAL);"
+            "CREATE TABLE IF NOT EXISTS result_keys (key TEXT PRIMARY KEY, result_id TEXT);")
+        self._connection.commit()
+
+    def _get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT r.id, r.result, r.image, r.created_at FROM result_keys k JOIN results r ON r.id = k.result_id"
+                " WHERE k.key = ?", (key,)).fetchone()
+            if row is None or now - row[3] > self.ttl or (row[2] and not os.path.exists(row[2])):
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE results SET accessed_at = ? WHERE id = ?", (now, row[0]))
+            self._connection.commit()
+            self.hits += 1
+
+        result = PipelineResult.from_dict(json.loads(row[1]))
+        result.image = row[2]
+        return result
+
+    def get_by_place(self, place_name: str):
+        """The cached PipelineResult for a place name, with `image` as the path of the cached overlay, or None."""
+        return self._get(place_key(place_name))
+
+    def get_by_coordinates(self, latitude, longitude):
+        if latitude == "NA" or longitude == "NA":
+            return None
+        return self._get(coordinate_key(latitude, longitude))
+
+    def put(self, result: PipelineResult):
+        """Store a result under its place name and, if resolved, its coordinates."""
+        data = result.as_dict()
+        payload = json.dumps(data, sort_keys=True, default=str)
+        # The key covers what was found, not how this run went, so identical analyses share an entry
+        content = {field: value for field, value in data.items() if field not in CONTENT_EXCLUDED_FIELDS}
+        image_bytes = self._encode_image(result.image)
+        digest = hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode() + (image_bytes or b'')).hexdigest()
+
+        image_path = None
+        if image_bytes is not None:
+            image_path = os.path.join(self.directory, digest + '.png')
+            if not os.path.exists(image_path):
+                with open(image_path, 'wb') as f:
+                    f.write(image_bytes)
+
+        keys = [place_key(result.place_name)]
+        if result.latitude != "NA" and result.longitude != "NA":
+            keys.append(coordinate_key(result.latitude, result.longitude))
+
+        now = time.time()
+        with self._lock:
+            previous = {row[0] for row in self._connection.execute(
+                f"SELECT result_id FROM result_keys WHERE key IN ({','.join('?' * len(keys))})", keys).fetchall()}
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, payload, image_path, len(payload) + len(image_bytes or b''), now, now))
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO result_keys VALUES (?, ?)", [(key, digest) for key in keys])
+
+            # Results the place or coordinates pointed to before are dropped once no key refers to them
+            for result_id in previous - {digest}:
+                if self._connection.execute("SELECT 1 FROM result_keys WHERE result_id = ?", (result_id,)).fetchone() is None:
+                    self._delete(result_id)
+            self._evict()
+            self._connection.commit()
+
+    def _delete(self, result_id: str):
+        row = self._connection.execute("SELECT image FROM results WHERE id = ?", (result_id,)).fetchone()
+        self._connection.execute("DELETE FROM results WHERE id = ?", (result_id,))
+        self._connection.execute("DELETE FROM result_keys WHERE result_id = ?", (result_id,))
+        if row is not None and row[0] and os.path.exists(row[0]):
+            os.remove(row[0])
+
+    def _encode_image(self, image):
+        if image is None:
+            return None
+        if isinstance(image, np.ndarray):
+            # Overlays are RGB arrays
+            ok, encoded = cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            return encoded.tobytes() if ok else None
+        if os.path.exists(image):
+            with open(image, 'rb') as f:
+                return f.read()
+        return None
+
+    def _evict(self):
+        expired = self._connection.execute(
+            "SELECT id, image FROM results WHERE created_at < ?", (time.time() - self.ttl,)).fetchall()
+        rows = self._connection.execute(
+            "SELECT id, image, size FROM results WHERE created_at >= ? ORDER BY accessed_at DESC",
+            (time.time() - self.ttl,)).fetchall()
+
+        # Keep the most recently used results within both bounds
+        evicted = list(expired)
+        total_bytes = 0
+        for index, (result_id, image, size) in enumerate(rows):
+            total_bytes += size
+            if index >= self.max_entries or total_bytes > self.max_bytes:
+                evicted.append((result_id, image))
+
+        for result_id, _ in evicted:
+            self._delete(result_id)
+
+    def invalidate(self, place_name: str):
+        """Forget the place name key, so the next request for it runs the pipeline again."""
+        with self._lock:
+            row = self._connection.execute("SELECT result_id FROM result_keys WHERE key = ?", (place_key(place_name),)).fetchone()
+            self._connection.execute("DELETE FROM result_keys WHERE key = ?", (place_key(place_name),))
+            if row is not None and self._connection.execute(
+                    "SELECT 1 FROM result_keys WHERE result_id = ?", (row[0],)).fetchone() is None:
+                self._delete(row[0])
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total_bytes = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """The process-wide result cache, opened on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from shapely.geometry import Polygon, box
+from config import ROOFTOP_INDEX_PATH, ROOFTOP_INDEX_MAX_AGE, ROOFTOP_INDEX_EDGE_MARGIN
+from geo import CROP_WIDTH, CROP_HEIGHT, LocalFrame, crop_to_degrees
+
+
+def bounds(points) -> tuple:
+    """(min_lat, max_lat, min_lon, max_lon) of (latitude, longitude) points, in R-tree column order."""
+    latitudes = [point[0] for point in points]
+    longitudes = [point[1] for point in points]
+    return min(latitudes), max(latitudes), min(longitudes), max(longitudes)
+
+
+def na_to_none(value):
+    return None if value == "NA" else value
+
+
+class RooftopIndex:
+    """
+    Persistent spatial index of detected rooftops, stored in SQLite with R-tree bounding boxes.
+
+    Each analysed view is a capture: its footprint, irradiance and time, and the geo-referenced
+    outlines and areas of the rooftops segmented in it. A point is answered from the most recent
+    capture younger than `max_age` seconds whose footprint covers it, `edge_margin` pixels inside
+    the crop so that roofs cut by the crop edge are never used, without searching or segmenting again.
+    """
+
+    def __init__(self, path: str = ROOFTOP_INDEX_PATH, max_age: float = ROOFTOP_INDEX_MAX_AGE,
+                 edge_margin: int = ROOFTOP_INDEX_EDGE_MARGIN):
+        self.path = path
+        self.max_age = max_age
+        self.edge_margin = edge_margin
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS captures ("
+            " id INTEGER PRIMARY KEY, place_name TEXT, latitude REAL, longitude REAL, metres_per_pixel REAL,"
+            " average_irradiance REAL, total_irradiance REAL, captured_at REAL);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS capture_bounds USING rtree(id, min_lat, max_lat, min_lon, max_lon);"
+            "CREATE TABLE IF NOT EXISTS rooftops ("
+            " id INTEGER PRIMARY KEY, capture_id INTEGER, mask INTEGER, polygon TEXT, area REAL);"
+            "CREATE INDEX IF NOT EXISTS rooftops_capture ON rooftops (capture_id);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS rooftop_bounds USING rtree(id, min_lat, max_lat, min_lon, max_lon);")
+        self._connection.commit()
+
+    def add_capture(self, place_name, latitude, longitude, metres_per_pixel, masks, mask_analysis,
+                    average_irradiance="NA", total_irradiance="NA", captured_at=None) -> int:
+        """
+        Record one analysed view.
+
+        Parameters:
+            place_name (str): The request the view was captured for.
+            latitude, longitude (float): The point the camera looked straight down at.
+            metres_per_pixel (float): Ground resolution of the view.
+            masks (CompactMasks): The segmented rooftops, with outlines in crop pixels.
+            mask_analysis (dict): The analysis of `masks`; its `all_mask_area` gives each rooftop's area.
+            average_irradiance, total_irradiance: Irradiance at the view, "NA" if unknown.
+
+        Returns:
+            int: The id of the capture.
+        """
+        captured_at = captured_at if captured_at is not None else time.time()
+        margin = self.edge_margin
+        footprint = crop_to_degrees([(margin, margin), (CROP_WIDTH - margin, CROP_HEIGHT - margin)],
+                                    latitude, longitude, metres_per_pixel)
+        areas = {int(mask): area for mask, area in mask_analysis.get("all_mask_area", {}).items()}
+
+        rooftops = []
+        for index, points in enumerate(masks.polygons):
+            if len(points) < 3:
+                continue
+            outline = crop_to_degrees(points, latitude, longitude, metres_per_pixel)
+            rooftops.append((index + 1, outline, areas.get(index + 1)))
+
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO captures (place_name, latitude, longitude, metres_per_pixel, average_irradiance,"
+                " total_irradiance, captured_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (place_name, latitude, longitude, metres_per_pixel, na_to_none(average_irradiance),
+                 na_to_none(total_irradiance), captured_at))
+            capture_id = cursor.lastrowid
+            self._connection.execute("INSERT INTO capture_bounds VALUES (?, ?, ?, ?, ?)", (capture_id, *bounds(footprint)))
+
+            for mask, outline, area in rooftops:
+                cursor = self._connection.execute(
+                    "INSERT INTO rooftops (capture_id, mask, polygon, area) VALUES (?, ?, ?, ?)",
+                    (capture_id, mask, json.dumps(outline), area))
+                self._connection.execute("INSERT INTO rooftop_bounds VALUES (?, ?, ?, ?, ?)",
+                                         (cursor.lastrowid, *bounds(outline)))
+
+            self._prune()
+            self._connection.commit()
+        return capture_id
+
+    def lookup(self, latitude, longitude, size_of_point: int = 20, max_age: float = None):
+        """
+        Answer a point from the freshest capture covering it.
+
+        The rooftop at the point is found as `analyze_masks` finds the target mask: the first rooftop,
+        in mask order, touching the square of `size_of_point` pixels (at the capture's resolution) around it.
+
+        Returns:
+            dict | None: The capture's place name, coordinates, irradiance and capture time, and a
+            `mask_analysis` with all its rooftop areas and the `target_mask` at the point (None if
+            the point is not on a roof); or None if no fresh capture covers the point.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            capture = self._connection.execute(
+                "SELECT c.id, c.place_name, c.latitude, c.longitude, c.metres_per_pixel, c.average_irradiance,"
+                " c.total_irradiance, c.captured_at FROM capture_bounds b JOIN captures c ON c.id = b.id"
+                " WHERE b.min_lat <= ? AND b.max_lat >= ? AND b.min_lon <= ? AND b.max_lon >= ? AND c.captured_at >= ?"
+                " ORDER BY c.captured_at DESC LIMIT 1",
+                (latitude, latitude, longitude, longitude, time.time() - max_age)).fetchone()
+            if capture is None:
+                self.misses += 1
+                return None
+            capture_id, place_name, capture_latitude, capture_longitude, metres_per_pixel, average, total, captured_at = capture
+
+            # Rooftops of the capture whose bounding box reaches the window around the point
+            frame = LocalFrame(latitude, longitude)
+            half_size = size_of_point * metres_per_pixel
+            min_lat, min_lon = frame.to_degrees(-half_size, -half_size)
+            max_lat, max_lon = frame.to_degrees(half_size, half_size)
+            candidates = self._connection.execute(
+                "SELECT r.mask, r.polygon FROM rooftop_bounds b JOIN rooftops r ON r.id = b.id"
+                " WHERE b.max_lat >= ? AND b.min_lat <= ? AND b.max_lon >= ? AND b.min_lon <= ? AND r.capture_id = ?"
+                " ORDER BY r.mask",
+                (min_lat, max_lat, min_lon, max_lon, capture_id)).fetchall()
+            areas = self._connection.execute(
+                "SELECT mask, area FROM rooftops WHERE capture_id = ? ORDER BY mask", (capture_id,)).fetchall()
+            self.hits += 1
+
+        window = box(-half_size, -half_size, half_size, half_size)
+        target = None
+        for mask, polygon in candidates:
+            outline = Polygon([frame.to_metres(point_latitude, point_longitude) for point_latitude, point_longitude in json.loads(polygon)])
+            if outline.buffer(0).intersects(window):
+                target = mask
+                break
+
+        all_mask_area = {mask: area for mask, area in areas}
+        return {
+            "capture_id": capture_id,
+            "place_name": place_name,
+            "latitude": capture_latitude,
+            "longitude": capture_longitude,
+            "average_irradiance": average if average is not None else "NA",
+            "total_irradiance": total if total is not None else "NA",
+            "captured_at": captured_at,
+            "mask_analysis": {
+                "all_mask_area": all_mask_area,
+                "target_mask": {target: all_mask_area[target]} if target is not None else None,
+            },
+        }
+
+    def _prune(self):
+        expired = [row[0] for row in self._connection.execute(
+            "SELECT id FROM captures WHERE captured_at < ?", (time.time() - self.max_age,)).fetchall()]
+        for capture_id in expired:
+            self._connection.execute(
+                "DELETE FROM rooftop_bounds WHERE id IN (SELECT id FROM rooftops WHERE capture_id = ?)", (capture_id,))
+            self._connection.execute("DELETE FROM rooftops WHERE capture_id = ?", (capture_id,))
+            self._connection.execute("DELETE FROM capture_bounds WHERE id = ?", (capture_id,))
+            self._connection.execute("DELETE FROM captures WHERE id = ?", (capture_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            captures = self._connection.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+            rooftops = self._connection.execute("SELECT COUNT(*) FROM rooftops").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "captures": captures,
+            "rooftops": rooftops,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_rooftop_index() -> RooftopIndex:
+    """The process-wide rooftop index, opened on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = RooftopIndex()
+        return _index
@@ -1,24 +1,41 @@
+import logging
 import cv2
+import numpy as np
 import pytesseract
 import re
 from geopy import Point
 from datetime import datetime, timedelta
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import POWER_API_URL, HTTP_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF_FACTOR, HTTP_POOL_SIZE
+from irradiance_cache import get_irradiance_cache
+from metrics import span, timed
 
+logger = logging.getLogger(__name__)
+
+@timed('ocr')
 def process_image_with_ocr(image_path, x, y, width, height, output_path="ocr_cropped.png"):
+    """
+    OCR the scale bar and coordinates strip of a Google Earth screenshot.
+
+    `image_path` may also be an already decoded BGR array; only the strip is converted to grayscale.
+    The strip is written to `output_path` unless it is None.
+    """
     try:
         # Set the path for Tesseract executable if it's not in your PATH
         pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'  # Adjust this path if necessary
 
         # Read the image
-        image = cv2.imread(image_path)
+        image = image_path if isinstance(image_path, np.ndarray) else cv2.imread(image_path)
         if image is None:
             raise ValueError(f"Image not found or unable to read: {image_path}")
 
-        # Convert to grayscale and crop
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        crop_image = gray_image[y:y + height, x:x + width]
-        cv2.imwrite(output_path, crop_image)
+        # Crop, then convert only the strip to grayscale
+        crop_image = cv2.cvtColor(image[y:y + height, x:x + width], cv2.COLOR_BGR2GRAY)
+        if output_path is not None:
+            cv2.imwrite(output_path, crop_image)
 
         # Perform OCR using PyTesseract
         raw_text = pytesseract.image_to_string(crop_image)
@@ -59,9 +76,57 @@ def get_lat_long_from_location(location):
         print(f"Error processing location '{location}': {e}")
         return "NA", "NA"
 
-def fetch_solar_irradiance(latitude, longitude):
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """A shared HTTP session with connection pooling and retries on transient errors."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR,
+                          status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+def aggregate_irradiance(response_data):
+    """Average daily and total irradiance of a NASA POWER daily ALLSKY_SFC_SW_DWN response."""
+    # Extract irradiance data from the response
+    irradiance_data = response_data['properties']['parameter']['ALLSKY_SFC_SW_DWN']
+
+    # Filter out invalid irradiance values (-999.0)
+    valid_irradiance_values = [value for value in irradiance_data.values() if value != -999.0]
+
+    # Calculate average and total irradiance
+    average_irradiance = round(sum(valid_irradiance_values) / len(valid_irradiance_values), 2)
+    total_irradiance = round(sum(valid_irradiance_values), 2)
+    return average_irradiance, total_irradiance
+
+def fetch_solar_irradiance(latitude, longitude, base_url=None, cache=None, session=None):
+    """
+    Average daily and total yearly irradiance at a point, from the NASA POWER API.
+
+    Results are served from the persistent irradiance cache when a fresh entry exists for the
+    point's grid cell. `base_url` defaults to POWER_API_URL, which can point at a local stub server.
+
+    With a replay `session` (a Recorder or Replayer) the HTTP response is recorded or played back
+    instead, and the cache is neither read nor written, so recordings always hold the response and
+    replays always parse it.
+    """
     if latitude == "NA" or longitude == "NA":
         return "NA", "NA"
+
+    cache = cache if cache is not None else get_irradiance_cache()
+    if session is None:
+        cached = cache.get(latitude, longitude)
+        if cached is not None:
+            return cached
+
+    # Query the centre of the grid cell so the cached value is the same for every point in it
+    latitude, longitude = cache.snap(latitude, longitude)
     
     # Get the current date and one year ago
     end_date = datetime.now()
@@ -72,7 +137,7 @@ def fetch_solar_irradiance(latitude, longitude):
     end_date_str = end_date.strftime("%Y%m%d")
 
     # Set up the base URL and parameters for the NASA API
-    base_url = "https://power.larc.nasa.gov/api/temporal/daily/point"
+    base_url = base_url or POWER_API_URL
     params = {
         "parameters": "ALLSKY_SFC_SW_DWN",
         "community": "RE",
@@ -84,39 +149,51 @@ def fetch_solar_irradiance(latitude, longitude):
     }
 
     # Make the request to the NASA API
-    response = requests.get(base_url, params=params)
-    response_data = response.json()
+    def request():
+        response = get_session().get(base_url, params=params, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
 
-    # Extract irradiance data from the response
-    irradiance_data = response_data['properties']['parameter']['ALLSKY_SFC_SW_DWN']
+    with span('irradiance_http'):
+        response_data = request() if session is None else session.call('irradiance_http', request)
 
-    # Filter out invalid irradiance values (-999.0)
-    valid_irradiance_values = [value for value in irradiance_data.values() if value != -999.0]
+    average_irradiance, total_irradiance = aggregate_irradiance(response_data)
 
-    # Calculate average and total irradiance
-    average_irradiance = sum(valid_irradiance_values) / len(valid_irradiance_values)
-    total_irradiance = sum(valid_irradiance_values)
+    if session is None:
+        cache.put(latitude, longitude, average_irradiance, total_irradiance)
+    return average_irradiance, total_irradiance
+
+def format_location(latitude, longitude):
+    """Format decimal coordinates the way Google Earth displays them, e.g. 57°09'52"N 2°06'06"W."""
+    def to_dms(value, positive, negative):
+        hemisphere = positive if value >= 0 else negative
+        total_seconds = round(abs(value) * 3600)
+        degrees, remainder = divmod(total_seconds, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{degrees}°{minutes:02d}'{seconds:02d}\"{hemisphere}"
 
-    return round(average_irradiance, 2), round(total_irradiance, 2)
+    return f"{to_dms(latitude, 'N', 'S')} {to_dms(longitude, 'E', 'W')}"
 
-# Main function to orchestrate the whole process
-def solar_info(image_path, x= 788, y= 605, width=2000, height=200):
+def solar_info(image_path, x= 788, y= 605, width=2000, height=200, output_path="ocr_cropped.png"):
     # Step 1: Process the image and extract the scale and location
-    scale, location = process_image_with_ocr(image_path, x, y, width, height)
-    print(f"Extracted Scale: {scale}")
-    print(f"Extracted Location: {location}")
+    scale, location = process_image_with_ocr(image_path, x, y, width, height, output_path)
 
     # Step 2: Convert the extracted location into latitude and longitude
-    latitude, longitude = get_lat_long_from_location(location)
-    print(f"Latitude: {latitude}, Longitude: {longitude}")
+    with span('geocode', source='ocr'):
+        latitude, longitude = get_lat_long_from_location(location)
 
     # Step 3: Fetch solar irradiance data based on the extracted coordinates
+    average_irradiance, total_irradiance = "NA", "NA"
     if latitude != "NA" and longitude != "NA":
         average_irradiance, total_irradiance = fetch_solar_irradiance(latitude, longitude)
-        print(f"Average Irradiance: {average_irradiance} kWh/m²/day")
-        print(f"Total Irradiance: {total_irradiance} kWh/m²/year")
-    else:
-        print("Invalid location for irradiance data.")
-    
+
+    logger.debug("Solar info", extra={"solar_info": {
+        "scale": scale,
+        "location": location,
+        "latitude": latitude,
+        "longitude": longitude,
+        "average_irradiance": average_irradiance,  # kWh/m²/day
+        "total_irradiance": total_irradiance,  # kWh/m²/year
+    }})
     return scale, location, average_irradiance, total_irradiance
 
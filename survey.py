@@ -0,0 +1,226 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from automation import GoogleEarthAutomation
+from browser_pool import BrowserPool
+from config import BATCH_SIZE, REPLAY_LATENCY_SCALE
+from jobs import normalize_place_name
+from model import InferenceBatcher
+from metrics import get_metrics
+from model_registry import warm_up
+from replay import Recorder, Replayer
+from rooftop_index import get_rooftop_index
+
+
+def read_places(path):
+    """
+    Place names from a CSV file (a `place_name` or `place` column, else the first column) or a
+    JSONL file (objects with `place_name`, or plain strings), in file order.
+    """
+    places = []
+    if path.endswith('.jsonl'):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    places.append(record['place_name'] if isinstance(record, dict) else str(record))
+    else:
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))
+        if rows:
+            header = [column.strip().lower() for column in rows[0]]
+            column = next((header.index(name) for name in ('place_name', 'place') if name in header), None)
+            if column is None:
+                column, body = 0, rows
+            else:
+                body = rows[1:]
+            places = [row[column] for row in body if len(row) > column and row[column].strip()]
+    return places
+
+
+def terminate_last_line(output_path):
+    """End the output with a newline if a crash cut its last line short, so the next record starts a line of its own."""
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def completed_places(output_path):
+    """Normalised names of places already written successfully to the output, for resuming."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash; the place is run again
+                continue
+            if record.get('status') == 'ok':
+                done.add(normalize_place_name(record['place_name']))
+    return done
+
+
+class SurveyRunner:
+    """
+    Runs many places through the pipeline: `browsers` pooled browser sessions search and capture
+    concurrently, while their crops are segmented in batches by a shared InferenceBatcher. Each
+    result is appended to the output JSONL as soon as it is ready, and that file doubles as the
+    checkpoint: places with an `ok` line are skipped when the run is restarted.
+
+    With `record` set to a folder, each place's browser steps, screenshots and irradiance response are
+    also archived there. With `replay` set to such a folder, no browser is started: places are played
+    back from their archives, `latency_scale` times as slowly as recorded, through the same pipeline.
+    """
+
+    def __init__(self, output_path, browsers=2, inference_workers=1, batch_size=BATCH_SIZE, run_id=None,
+                 record=None, replay=None, latency_scale=REPLAY_LATENCY_SCALE):
+        self.output_path = output_path
+        self.browsers = browsers
+        self.record = record
+        self.replay = replay
+        self.latency_scale = latency_scale
+        self.run_id = run_id or time.strftime('%Y%m%d_%H%M%S')
+        self.batcher = InferenceBatcher(batch_size=batch_size, workers=inference_workers)
+        self.pool = None
+
+        self._write_lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.stage_seconds = {}
+        self.stage_counts = {}
+
+    def segment(self, crop, output_path):
+        return self.batcher.submit(crop, output_path).result()
+
+    def run_place(self, place_name):
+        start_time = time.perf_counter()
+        try:
+            if self.replay:
+                # Replays always segment, so the downstream stages are what gets measured
+                automation = GoogleEarthAutomation(os.path.join('survey', self.run_id), place_name, in_memory=True,
+                                                   archive=False, segmenter=self.segment,
+                                                   session=Replayer(place_name, self.replay, self.latency_scale))
+                result = automation.process()
+                automation.close()
+            else:
+                with self.pool.lease() as driver:
+                    # A recorded place must run every step, so that its replay finds them all: the index
+                    # is then only written to, never answered from
+                    session = Recorder(place_name, self.record) if self.record else None
+                    automation = GoogleEarthAutomation(os.path.join('survey', self.run_id), place_name, driver=driver,
+                                                       in_memory=True, archive=False, segmenter=self.segment,
+                                                       rooftop_index=get_rooftop_index(), index_answers=session is None,
+                                                       session=session)
+                    result = automation.process()
+                    automation.close()
+            record = {**result.as_dict(), "status": "ok" if not result.errors else "failed"}
+        except Exception as e:
+            record = {"place_name": place_name, "status": "failed", "errors": {"pipeline": str(e)}, "trace": []}
+        record["seconds"] = time.perf_counter() - start_time
+        self.write(record)
+
+    def write(self, record):
+        with self._write_lock:
+            with open(self.output_path, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            if record["status"] == 'ok':
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            for entry in record.get("trace", []):
+                self.stage_seconds[entry["stage"]] = self.stage_seconds.get(entry["stage"], 0.0) + entry["seconds"]
+                self.stage_counts[entry["stage"]] = self.stage_counts.get(entry["stage"], 0) + 1
+
+            done = self.succeeded + self.failed
+            print(f"[{done}/{self.total}] {record['place_name']}: {record['status']} in {record['seconds']:.1f} seconds")
+
+    def run(self, places):
+        terminate_last_line(self.output_path)
+        done = completed_places(self.output_path)
+        remaining = []
+        seen = set(done)
+        for place_name in places:
+            key = normalize_place_name(place_name)
+            if key not in seen:
+                seen.add(key)
+                remaining.append(place_name)
+        self.total = len(remaining)
+        print(f"{len(places)} places, {len(done)} already done, {self.total} to run")
+        if not remaining:
+            return self.report(0.0)
+
+        warm_up()
+        if not self.replay:
+            self.pool = BrowserPool(size=self.browsers).start()
+        start_time = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.browsers) as executor:
+                list(executor.map(self.run_place, remaining))
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+        return self.report(time.perf_counter() - start_time)
+
+    def report(self, elapsed):
+        finished = self.succeeded + self.failed
+        batcher = self.batcher.stats()
+        report = {
+            "places": finished,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "seconds": elapsed,
+            "places_per_minute": finished * 60 / elapsed if elapsed else 0.0,
+            "inference_batches": batcher["batches"],
+            "mean_batch_size": batcher["mean_batch_size"],
+            "stages": {stage: {"total_seconds": seconds, "mean_seconds": seconds / self.stage_counts[stage]}
+                       for stage, seconds in self.stage_seconds.items()},
+            "metrics": get_metrics().snapshot(),
+        }
+        print(f"Finished {finished} places in {elapsed:.1f} seconds ({report['places_per_minute']:.2f} places/minute)")
+        for stage, timing in report["stages"].items():
+            print(f"  {stage}: mean {timing['mean_seconds']:.2f}s, total {timing['total_seconds']:.1f}s")
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Survey rooftop solar potential for many places")
+    parser.add_argument('places', help="CSV or JSONL file of place names")
+    parser.add_argument('--output', default='survey_results.jsonl', help="JSONL results, also used to resume")
+    parser.add_argument('--browsers', type=int, default=2, help="Concurrent browser sessions (concurrent replays with --replay)")
+    parser.add_argument('--inference-workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--report', help="Also write the final report to this JSON file")
+    replay_group = parser.add_mutually_exclusive_group()
+    replay_group.add_argument('--record', metavar='FOLDER', help="Also archive each place's browser and HTTP calls here")
+    replay_group.add_argument('--replay', metavar='FOLDER', help="Play places back from archives here instead of a browser")
+    parser.add_argument('--latency-scale', type=float, default=REPLAY_LATENCY_SCALE,
+                        help="With --replay, multiplier of the recorded latencies (0 for full speed)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    runner = SurveyRunner(args.output, browsers=args.browsers, inference_workers=args.inference_workers,
+                          batch_size=args.batch_size, record=args.record, replay=args.replay,
+                          latency_scale=args.latency_scale)
+    report = runner.run(read_places(args.places))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
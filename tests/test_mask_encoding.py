@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mask_encoding import CompactMasks
+
+
+def random_masks(count, height=47, width=54, seed=0):
+    rng = np.random.default_rng(seed)
+    masks = np.zeros((count, height, width), dtype=np.float32)
+    for mask in masks:
+        x, y = rng.integers(0, width - 5), rng.integers(0, height - 5)
+        mask[y:y + rng.integers(2, 20), x:x + rng.integers(2, 20)] = 1.0
+    return masks
+
+
+def dense_hits(masks, points, size_of_point):
+    hits = []
+    for x, y in points:
+        window = masks[:, max(0, y - size_of_point):y + size_of_point + 1, max(0, x - size_of_point):x + size_of_point + 1]
+        covered = (window > 0.5).reshape(len(masks), -1).any(axis=1)
+        hits.append(int(np.argmax(covered)) if covered.any() else None)
+    return hits
+
+
+def test_zero_masks_encode_to_empty():
+    masks = CompactMasks.from_mask_data(np.zeros((0, 47, 54), dtype=np.float32))
+    assert len(masks) == 0
+    assert masks.size == (47, 54)
+    assert masks.areas() == []
+    assert masks.masks_at_points([(27, 23)]) == [None]
+    assert masks.to_dense().shape == (0, 47, 54)
+    assert masks.overlap_counts().sum() == 0
+    restored = CompactMasks.from_dict(json.loads(json.dumps(masks.to_dict())))
+    assert len(restored) == 0
+
+
+def test_matches_dense_masks():
+    dense = random_masks(30)
+    dense[5] = 0.0  # A mask without any foreground pixel
+    masks = CompactMasks.from_mask_data(dense)
+    binary = (dense > 0.5).astype(np.uint8)
+
+    assert masks.areas() == binary.reshape(len(dense), -1).sum(axis=1).tolist()
+    points = [(0, 0), (27, 23), (53, 46), (10, 40), (40, 5)]
+    for size_of_point in (0, 3, 20):
+        assert masks.masks_at_points(points, size_of_point) == dense_hits(dense, points, size_of_point)
+    assert np.array_equal(masks.to_dense(), binary)
+    assert np.array_equal(masks.overlap_counts(), binary.sum(axis=0))
+
+    restored = CompactMasks.from_dict(json.loads(json.dumps(masks.to_dict())))
+    assert np.array_equal(restored.to_dense(), binary)
+    assert restored.areas() == masks.areas()